@@ -1,18 +1,74 @@
-from pyearley.earley import EarleyParser as PureEarleyParser
+from pyearley.earley import EarleyParser as PureEarleyParser, ParseCancelled, ParseBudget, BudgetExceeded
 from pyearley.rule import OneOrMore, ZeroOrMore, Optional, Literal, Forward, Or, And, one_of, optional, star, plus
-from pyearley.tree import prune
+from pyearley.tree import prune, ParseNode
+from pyearley.forest import Forest, SymbolNode, PackedNode, TerminalNode, CyclicForestError
+from pyearley.grammar import CompiledGrammar, compile_grammar, optimize_rules
+from pyearley.lattice import Lattice
+from pyearley.session import ParseSession
+from pyearley.partial import PartialParse
+from pyearley.spans import SpanChart
+from pyearley.batch import parse_many
+from pyearley.stats import ParseStats, StateSetStats
+from pyearley.stats import timer as _timer
 
 class EarleyParser():
-    def __init__(self, pyearley_rules):
+    def __init__(self, pyearley_rules, lookahead=True, optimize=False):
+        #Either a pyearley symbol or an already compiled (or loaded) grammar
         self.rules = pyearley_rules
 
-        expanded_rules = pyearley_rules.get_expanded_ruleset()
-        self.parser = PureEarleyParser(expanded_rules)
+        if isinstance(pyearley_rules, CompiledGrammar):
+            self.grammar = pyearley_rules
+        else:
+            self.grammar = compile_grammar(pyearley_rules, optimize)
+
+        self.parser = PureEarleyParser(self.grammar, lookahead)
 
     def parse(self, tokens, target_symbol, **kwargs):
-        trees = self.parser.parse(tokens, target_symbol, should_traceback=True, **kwargs)
+        return self.parser.parse(tokens, target_symbol, should_traceback=True, prune_temp=True, **kwargs)
+
+    def recognize(self, tokens, target_symbol, **kwargs):
+        return self.parser.recognize(tokens, target_symbol, **kwargs)
+
+    def iter_parses(self, tokens, target_symbol, **kwargs):
+        return self.parser.iter_parses(tokens, target_symbol, prune_temp=True, **kwargs)
+
+    def count_parses(self, tokens, target_symbol, **kwargs):
+        return self.parser.count_parses(tokens, target_symbol, **kwargs)
+
+    def is_ambiguous(self, tokens, target_symbol, **kwargs):
+        return self.parser.is_ambiguous(tokens, target_symbol, **kwargs)
+
+    def parse_many(self, token_lists, target_symbol, **kwargs):
+        return parse_many(self.grammar, token_lists, target_symbol, **kwargs)
+
+    def parse_partial(self, tokens, target_symbol, **kwargs):
+        return self.parser.parse_partial(tokens, target_symbol, prune_temp=True, **kwargs)
+
+    def parse_spans(self, tokens, symbols=None, **kwargs):
+        return self.parser.parse_spans(tokens, symbols, prune_temp=True, **kwargs)
+
+    def session(self, target_symbol):
+        return ParseSession(self.parser, target_symbol, self.grammar.temp_symbols)
+
+    def inside_probability(self, tokens, target_symbol, **kwargs):
+        return self.parser.inside_probability(tokens, target_symbol, **kwargs)
+
+    def k_best_parses(self, tokens, target_symbol, k=1, **kwargs):
+        return self.parser.k_best_parses(tokens, target_symbol, k, prune_temp=True, **kwargs)
+
+    def best_parse(self, tokens, target_symbol, **kwargs):
+        parses = self.k_best_parses(tokens, target_symbol, 1, **kwargs)
+
+        return parses[0] if parses else None
+
+    def parse_forest(self, tokens, target_symbol, **kwargs):
+        forest = self.parser.parse_forest(tokens, target_symbol, **kwargs)
+
+        if forest is not None:
+            start = _timer()
+            forest = forest.prune(self.grammar.temp_symbols)
 
-        for tree in trees:
-            prune(tree, target_symbol)
+            if kwargs.get("stats") is not None:
+                kwargs["stats"]._add_time("prune", _timer() - start)
 
-        return trees
\ No newline at end of file
+        return forest
\ No newline at end of file
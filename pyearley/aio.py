@@ -0,0 +1,66 @@
+#encoding: UTF-8
+
+import asyncio, functools, threading
+
+# asyncio support
+# Parses run in an executor so that they do not block the event loop.
+# A parse that times out or whose awaiting task is cancelled is stopped as well,
+# through the cancel event it checks while running (see `EarleyParser.parse`).
+# Awaitables are created from a coroutine, on the running event loop.
+
+class AsyncEarleyParser(object):
+    def __init__(self, parser, executor=None):
+        #either parser class; parsers are reentrant, so a single one serves all the concurrent parses
+        self.parser = parser
+        #None runs the parses in the default executor of the event loop
+        self.executor = executor
+
+    def _run(self, method, args, kwargs, timeout):
+        loop = asyncio.get_running_loop()
+
+        #a caller's cancel event still stops the parse, and is set as well when the parse is given up here
+        if kwargs.get("cancel_event") is None:
+            kwargs["cancel_event"] = threading.Event()
+
+        cancel_event = kwargs["cancel_event"]
+
+        future = loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+        #the awaiting side gave up: stop the parse at its next check
+        def __on_done(f):
+            if f.cancelled():
+                cancel_event.set()
+
+        future.add_done_callback(__on_done)
+
+        if timeout is not None:
+            return asyncio.wait_for(future, timeout)
+
+        return future
+
+    def parse(self, tokens, target_symbol, timeout=None, **kwargs):
+        """
+        Returns an awaitable of the trees of `parser.parse`, which raises asyncio.TimeoutError after `timeout` seconds
+        """
+        return self._run(self.parser.parse, (tokens, target_symbol), kwargs, timeout)
+
+    def recognize(self, tokens, target_symbol, timeout=None, **kwargs):
+        return self._run(self.parser.recognize, (tokens, target_symbol), kwargs, timeout)
+
+    def parse_forest(self, tokens, target_symbol, timeout=None, **kwargs):
+        return self._run(self.parser.parse_forest, (tokens, target_symbol), kwargs, timeout)
+
+    def count_parses(self, tokens, target_symbol, timeout=None, **kwargs):
+        return self._run(self.parser.count_parses, (tokens, target_symbol), kwargs, timeout)
+
+    def is_ambiguous(self, tokens, target_symbol, timeout=None, **kwargs):
+        return self._run(self.parser.is_ambiguous, (tokens, target_symbol), kwargs, timeout)
+
+    def best_parse(self, tokens, target_symbol, timeout=None, **kwargs):
+        return self._run(self.parser.best_parse, (tokens, target_symbol), kwargs, timeout)
+
+    def k_best_parses(self, tokens, target_symbol, k=1, timeout=None, **kwargs):
+        return self._run(self.parser.k_best_parses, (tokens, target_symbol, k), kwargs, timeout)
+
+    def inside_probability(self, tokens, target_symbol, timeout=None, **kwargs):
+        return self._run(self.parser.inside_probability, (tokens, target_symbol), kwargs, timeout)
@@ -0,0 +1,156 @@
+#encoding: UTF-8
+
+import itertools
+from pyearley.earley import EarleyParser, BudgetExceeded
+from pyearley.grammar import CompiledGrammar, compile_grammar
+from pyearley.forest import fold_derivation
+from pyearley.rule import Symbol
+
+# Batch parsing
+# The compiled grammar is sent once to every worker process, which parses chunks of inputs
+# and sends back compact results: plain tuples instead of parse trees.
+
+MODES = ("trees", "best", "count", "recognize")
+
+#parser of the worker process, created from the compiled grammar by the pool initializer
+_worker_parser = None
+
+def _init_worker(grammar_data):
+    global _worker_parser
+    _worker_parser = EarleyParser(CompiledGrammar.from_dict(grammar_data))
+
+def _parse_chunk(task):
+    chunk, target, mode, max_trees, budget = task
+
+    return [(idx, parse_result(_worker_parser, tokens, target, mode, max_trees, budget)) for idx, tokens in chunk]
+
+def derivation_tuple(derivation, temp_symbols=()):
+    """
+    Converts a forest derivation to nested tuples:
+    (symbol, child, ...) for nonterminal symbols, in right hand side order, and (terminal, token) for terminals.
+    Temporary symbols are replaced by their children, except at the root.
+    """
+    return fold_derivation(derivation, _terminal_tuple, _symbol_tuple, temp_symbols)
+
+def _terminal_tuple(node):
+    return (node.symbol, node.token)
+
+def _symbol_tuple(node, packed, children):
+    return (node.symbol, ) + tuple(children)
+
+def parse_result(parser, tokens, target_symbol, mode="trees", max_trees=None, budget=None):
+    """
+    Compact, serializable result of parsing the tokens:
+    the list of tree tuples ("trees"), the (tree tuple, weight) pair of the best parse or None ("best"),
+    the number of parses ("count"), or whether the tokens can be derived at all ("recognize").
+    Tokens whose parse runs out of the `budget` give the BudgetExceeded exception instead,
+    so that a single pathological input does not stall its worker.
+    """
+    try:
+        return _parse_result(parser, tokens, target_symbol, mode, max_trees, budget)
+    except BudgetExceeded as e:
+        return e
+
+def _parse_result(parser, tokens, target_symbol, mode, max_trees, budget):
+    if mode == "recognize":
+        return parser.recognize(tokens, target_symbol, budget=budget)
+
+    if mode == "count":
+        return parser.count_parses(tokens, target_symbol, budget=budget)
+
+    chart = parser._build_chart(tokens, target_symbol, budget=budget)
+    forest = parser._chart_forest(chart, target_symbol)
+    tracker = chart.budget
+    del chart
+
+    temp_symbols = parser.grammar.temp_symbols
+
+    if mode == "best":
+        if forest is None:
+            return None
+
+        weight, derivation = forest.k_best(1, *parser._weight_functions(tokens, "max"))[0]
+
+        return (derivation_tuple(derivation, temp_symbols), weight)
+
+    trees = []
+
+    if forest is None or max_trees == 0:
+        return trees
+
+    #one tree per derivation, as `EarleyParser.parse` gives, even when pruning temporary symbols makes trees look alike
+    for derivation in forest.derivations():
+        if tracker is not None:
+            tracker.check_trees(len(trees), trees)
+
+        trees.append(derivation_tuple(derivation, temp_symbols))
+
+        if max_trees is not None and len(trees) >= max_trees:
+            break
+
+    return trees
+
+def _chunks(token_lists, chunksize):
+    #chunks of (input index, tokens) pairs
+    token_lists = enumerate(token_lists)
+
+    while True:
+        chunk = list(itertools.islice(token_lists, chunksize))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+def parse_many(grammar, token_lists, target_symbol, workers=None, chunksize=16, ordered=True, mode="trees", max_trees=None, budget=None):
+    """
+    Parses many inputs over a pool of worker processes, which receive the compiled grammar once.
+    Returns an iterator over the results (see `parse_result`) in input order,
+    or over (input index, result) pairs in completion order when not `ordered`.
+    The grammar is a CompiledGrammar, a `pyearley.rule` symbol or a list of rules.
+    Workers default to the number of CPUs; with a single worker, inputs are parsed in this process.
+    Every input is parsed within the `ParseBudget`, if given.
+    """
+    if mode not in MODES:
+        raise ValueError("unknown mode: {}".format(mode))
+
+    if isinstance(grammar, Symbol):
+        grammar = compile_grammar(grammar)
+    elif not isinstance(grammar, CompiledGrammar):
+        grammar = CompiledGrammar(grammar)
+
+    target = grammar.name_of(target_symbol)
+    chunks = _chunks(token_lists, chunksize)
+
+    if workers == 1:
+        return _iter_results(_parse_chunks(EarleyParser(grammar), chunks, target, mode, max_trees, budget), ordered)
+
+    return _iter_pool_results(grammar, chunks, target, mode, max_trees, budget, workers, ordered)
+
+def _parse_chunks(parser, chunks, target, mode, max_trees, budget):
+    for chunk in chunks:
+        yield [(idx, parse_result(parser, tokens, target, mode, max_trees, budget)) for idx, tokens in chunk]
+
+def _iter_pool_results(grammar, chunks, target, mode, max_trees, budget, workers, ordered):
+    #multiprocessing is only imported by the parses that start a pool
+    import multiprocessing
+
+    pool = multiprocessing.Pool(workers, _init_worker, (grammar.to_dict(), ))
+    tasks = ((chunk, target, mode, max_trees, budget) for chunk in chunks)
+
+    try:
+        if ordered:
+            chunk_results = pool.imap(_parse_chunk, tasks)
+        else:
+            chunk_results = pool.imap_unordered(_parse_chunk, tasks)
+
+        for result in _iter_results(chunk_results, ordered):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _iter_results(chunk_results, ordered):
+    for results in chunk_results:
+        for idx, result in results:
+            yield result if ordered else (idx, result)
@@ -1,8 +1,13 @@
 #encoding: UTF-8
 
-import functools, copy
-from pyearley.tree import GraphBuilder
-from pyearley.tree import InternalNode, LeafNode
+from pyearley.tree import ParseNode
+from pyearley.forest import Forest, SymbolNode, TerminalNode, CyclicForestError, fold_derivation
+from pyearley.grammar import CompiledGrammar
+from pyearley.lattice import Lattice, _iter_candidates
+from pyearley.session import ParseSession
+from pyearley.partial import PartialParse
+from pyearley.spans import SpanChart
+from pyearley.stats import timer
 
 class Item(object):
     def __init__(self, dot_idx, src_idx, rule_idx):
@@ -32,40 +37,207 @@ class Item(object):
     def __getitem__(self, item):
         return self.data.__getitem__(item)
 
-class EarleyParser(object):
-    def __init__(self, rules):
-        self.rules = list(rules)
+#Back-pointers of the items with the dot at the leftmost position
+_TRACEBACK_INIT = [(None, None)]
+
+#Bound on the fixed point iterations computing the weights of empty derivations, which may not converge on recursive empty rules
+_MAX_NULLABLE_ITERATIONS = 1000
+
+#Items popped from the agenda of a state set between two checks of the parse budget
+_BUDGET_CHECK_INTERVAL = 1024
+
+class ParseCancelled(Exception):
+    """
+    Raised by a parse whose cancel event was set
+    """
+    pass
+
+class BudgetExceeded(ParseCancelled):
+    """
+    Raised by a parse that ran out of one of the limits of its ParseBudget.
+    `limit` names the limit and `value` is its value; `partial` holds the trees built until then, if any.
+    """
+    def __init__(self, limit, value, partial=None):
+        super(BudgetExceeded, self).__init__(limit, value, partial)
+        self.limit = limit
+        self.value = value
+        self.partial = partial
+
+    def __str__(self):
+        return "parse budget exceeded: {} ({})".format(self.limit, self.value)
+
+class ParseBudget(object):
+    """
+    Limits on the work of a single parse, None being no limit.
+    A parse given a budget raises BudgetExceeded as soon as it runs out of any of them.
+    Budgets hold no state, so a single one serves any number of parses.
+    """
+    def __init__(self, timeout=None, max_items=None, max_state_set_items=None, max_back_pointers=None, max_forest_nodes=None, max_trees=None):
+        #wall-clock seconds from the start of the parse
+        self.timeout = timeout
+        #chart items, over all the state sets and in any single one
+        self.max_items = max_items
+        self.max_state_set_items = max_state_set_items
+        #back-pointers over all the state sets, checked as each state set is closed
+        self.max_back_pointers = max_back_pointers
+        #nodes of the parse forest, terminal nodes included
+        self.max_forest_nodes = max_forest_nodes
+        #trees enumerated
+        self.max_trees = max_trees
+
+    def __repr__(self):
+        limits = ("{}={}".format(k, v) for k, v in sorted(self.__dict__.items()) if v is not None)
+
+        return "ParseBudget ({})".format(", ".join(limits))
+
+class _BudgetTracker(object):
+    #Usage of a ParseBudget by a single parse
+    def __init__(self, budget):
+        self.budget = budget
+        self.deadline = timer() + budget.timeout if budget.timeout is not None else None
+        #items and back-pointers of the closed state sets
+        self.items = 0
+        self.back_pointers = 0
+
+    def check(self, state_set_items=0, partial=None):
+        #`state_set_items` are the items of the state set being closed, and `partial` the trees built so far
+        budget = self.budget
+
+        if self.deadline is not None and timer() > self.deadline:
+            raise BudgetExceeded("timeout", budget.timeout, partial)
 
-        #Manage empty rules separately
-        self.empty_rules = [i for i, rule in enumerate(self.rules) if len(rule) == 1]
+        if budget.max_state_set_items is not None and state_set_items > budget.max_state_set_items:
+            raise BudgetExceeded("max_state_set_items", budget.max_state_set_items, partial)
 
-        #Cache dictionary
-        self.rule_dict = {}
+        if budget.max_items is not None and self.items + state_set_items > budget.max_items:
+            raise BudgetExceeded("max_items", budget.max_items, partial)
 
-        for i, r in enumerate(self.rules):
-            if r[0] not in self.rule_dict:
-                self.rule_dict[r[0]] = []
+    def close_state_set(self, items, back_pointers):
+        self.check(items)
+        self.items += items
+        self.back_pointers += back_pointers
 
-            self.rule_dict[r[0]].append(i)
+        if self.budget.max_back_pointers is not None and self.back_pointers > self.budget.max_back_pointers:
+            raise BudgetExceeded("max_back_pointers", self.budget.max_back_pointers)
 
-        #All symbol set
-        self.vocab = functools.reduce(lambda x, y: x | set(y), self.rules, set())
+    def check_forest(self, forest_nodes):
+        self.check()
 
-        #Cache nonterminal symbols
-        self.vocab_nonterminal = set([r[0] for r in self.rules])
+        if self.budget.max_forest_nodes is not None and forest_nodes > self.budget.max_forest_nodes:
+            raise BudgetExceeded("max_forest_nodes", self.budget.max_forest_nodes)
 
-        #Cache terminal symbols
-        self.vocab_terminal = self.vocab.difference(self.vocab_nonterminal)
+    def check_trees(self, trees, partial=None):
+        #before enumerating one more tree, `trees` being already enumerated
+        self.check(partial=partial)
 
-        #Cache nonterminal symbols for each rule
-        #self.rule_nonterminals = [set(r[1:]) & self.vocab_nonterminal for r in self.rules]
+        if self.budget.max_trees is not None and trees >= self.budget.max_trees:
+            raise BudgetExceeded("max_trees", self.budget.max_trees, partial)
+
+class _Chart(object):
+    #State of a parse: state sets with their per-symbol indices, back-pointers and Leo's reduction paths
+    def __init__(self, n_state_sets=1, cancel_event=None, budget=None):
+        self.state_sets = []
+
+        #maps each symbol id to the items in the corresponding state set that are waiting for it
+        self.waiting = []
 
         # Setup Traceback
         # data structure for managing tracebacks
-        # maps (item, cur_idx) to list of terminal tokens or other (item, cur_idx) tuples
-        self._traceback = {}
+        # per state set (cur_idx), maps items to lists of (stack item, (prev_item, prev_state_idx)) tuples,
+        # where the stack item is a completed (item, cur_idx), a scanned ((terminal, token), cur_idx) or None for skipped nullable symbols.
+        # Items with the dot at the leftmost position have no entry.
+        self.traceback = []
+
+        # Leo's optimization
+        # per state set, maps a symbol to its deterministic reduction path: (the only item waiting for it, topmost completed item) or None
+        self.leo = []
+        # maps state indices to the completed items whose completion went straight to the top of a reduction path
+        self.leo_entries = {}
+        # maps state indices to the completed items skipped on those paths, once they are materialized
+        self.leo_completed = {}
+
+        #the parse stops with ParseCancelled once this event is set
+        self.cancel_event = cancel_event
+
+        #usage of the ParseBudget of the parse, if any
+        self.budget = _BudgetTracker(budget) if budget is not None else None
+
+        #nonterminal symbol ids predicted when seeding the first state set
+        self.seed_predicted = set()
+
+        #ParseStats recording the parse, if any
+        self.stats = None
+
+        #(position, expected terminal symbols) where a parse with error recovery first could not go on, if it did
+        self.failure = None
+
+        self.extend(n_state_sets)
+
+    def extend(self, n_state_sets):
+        while len(self.state_sets) < n_state_sets:
+            self.state_sets.append(set())
+            self.waiting.append({})
+            self.leo.append({})
+            self.traceback.append({})
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ParseCancelled()
+
+    def close_state_set(self, state_idx):
+        #Counts the items and back-pointers of a closed state set against the budget
+        if self.budget is not None:
+            self.budget.close_state_set(len(self.state_sets[state_idx]), sum(len(d) for d in self.traceback[state_idx].values()))
+
+    def truncate(self, n_state_sets):
+        #Drops the state sets from the given index on, along with everything recorded in them
+        del self.state_sets[n_state_sets:]
+        del self.waiting[n_state_sets:]
+        del self.leo[n_state_sets:]
+        del self.traceback[n_state_sets:]
+
+        for entries in (self.leo_entries, self.leo_completed):
+            for state_idx in [i for i in entries if i >= n_state_sets]:
+                del entries[state_idx]
+
+class EarleyParser(object):
+    def __init__(self, rules, lookahead=True):
+        #Grammar tables are precomputed by the compiled grammar
+        if not isinstance(rules, CompiledGrammar):
+            rules = CompiledGrammar(rules)
+
+        self.grammar = rules
+        self.rules = self.grammar.rules
+
+        self.rule_dict = self.grammar.rule_dict
+        self.vocab = self.grammar.vocab
+        self.vocab_nonterminal = self.grammar.vocab_nonterminal
+        self.vocab_terminal = self.grammar.vocab_terminal
+
+        #An item is packed as (source state index << item_shift) | dotted rule id.
+        self._item_shift = max(len(self.grammar.dotted_rule), 1).bit_length()
+        self._item_mask = (1 << self._item_shift) - 1
+
+        #Only predict the rules that can start with a token of the position (FIRST sets of the compiled grammar)
+        self.lookahead = lookahead
+
+        #The parser is never modified after this point: the state of every parse lives in its own chart,
+        #so that a parser can serve concurrent parses.
+
+        # Weights
+        self._rule_weights = dict(zip(self.rules, self.grammar.rule_weights))
+        # weights of the empty derivations of nullable symbols, summed ("sum") or maximized ("max") over their derivations.
+        # They are only computed by the first weighted parse, since most parsers never weight anything;
+        # concurrent parses may compute them twice, but always store the same weights.
+        self._empty_weights = {}
+
+    def decode(self, item):
+        dotted_rule = item & self._item_mask
+
+        return Item(self.grammar.dotted_dot[dotted_rule], item >> self._item_shift, self.grammar.dotted_rule[dotted_rule])
 
     def visualize(self, item):
+        item = self.decode(item)
         rule = self.rules[item.rule_idx]
         dot_idx = item.dot_idx
 
@@ -75,248 +247,995 @@ class EarleyParser(object):
 
         return "({}) {} -> {}".format(item.src_idx, lhs, " ".join(rhs))
 
-    def _traceback_add(self, item, state_idx, stack_item, prev_item=None, prev_state_idx=None):
-        key = (item, state_idx)
+    def _traceback_paths(self, chart, item, state_idx):
+        if self.grammar.dotted_dot[item & self._item_mask] == 0:
+            return _TRACEBACK_INIT
 
-        if key not in self._traceback:
-            self._traceback[key] = []
+        #only completed items are skipped by Leo's optimization
+        if state_idx in chart.leo_entries and self.grammar.dotted_next[item & self._item_mask] < 0:
+            self._leo_unfold(chart, state_idx)
 
-        self._traceback[key].append({"item": stack_item,
-                                     "ref": (prev_item, prev_state_idx)})
+        return chart.traceback[state_idx][item]
 
-    def _traceback_init(self, item, state_idx):
-        self._traceback[(item, state_idx)] = [{"item": None, "ref": None}]
+    def _leo_path(self, leo, waiting, state_idx, symbol):
+        """
+        Returns the deterministic reduction path of the symbol in the state set, or None.
+        A path exists when a single item waits for the symbol and the symbol is the last one of its rule;
+        it goes on through the state set where that item started, and so on.
+        Paths never go through state set 0, so completed items starting there are never skipped.
+        """
+        path = []
+        cur_state_idx, cur_symbol = state_idx, symbol
 
-    def _traceback_create_tree(self, item, state_idx):
-        def __traceback_expand(item, state_idx, cache):
-            if (item, state_idx) in cache:
-                return cache[(item, state_idx)]
+        while cur_symbol not in leo[cur_state_idx]:
+            items = waiting[cur_state_idx].get(cur_symbol, ())
 
-            rule = self.rules[item.rule_idx]
-            symbol = rule[0]
+            if cur_state_idx == 0 or len(items) != 1 or self.grammar.dotted_next[(items[0] & self._item_mask) + 1] >= 0:
+                leo[cur_state_idx][cur_symbol] = None
+                break
 
-            candidates = set()
+            path.append((cur_state_idx, cur_symbol, items[0]))
 
-            for path in self._traceback[(item, state_idx)]:
-                it = path["item"]
-                ref = path["ref"]
+            new_item = items[0] + 1
+            cur_state_idx = new_item >> self._item_shift
+            cur_symbol = self.grammar.dotted_lhs[new_item & self._item_mask]
 
-                if ref is None:
-                    traces = {tuple()}
-                else:
-                    prev_item, prev_state_idx = ref
-                    traces = __traceback_expand(prev_item, prev_state_idx, cache)
+        top = leo[cur_state_idx][cur_symbol]
+        top = top[1] if top is not None else None
+
+        #the items on the path share the topmost completed item
+        for path_state_idx, path_symbol, item in reversed(path):
+            if top is None:
+                top = item + 1
+
+            leo[path_state_idx][path_symbol] = (item, top)
+
+        return leo[state_idx][symbol]
+
+    def _leo_unfold(self, chart, state_idx):
+        #Materializes the completed items skipped by Leo's optimization in the state set, along with their back-pointers
+        materialized = chart.leo_completed.setdefault(state_idx, set())
+        traceback = chart.traceback[state_idx]
+
+        for child in chart.leo_entries.pop(state_idx):
+            src_state_idx = child >> self._item_shift
+            symbol = self.grammar.dotted_lhs[child & self._item_mask]
+
+            while True:
+                it, top = chart.leo[src_state_idx][symbol]
+                new_item = it + 1
+
+                if new_item not in traceback:
+                    traceback[new_item] = []
+
+                traceback[new_item].append(((child, state_idx), (it, src_state_idx)))
+
+                #the rest of the path was already materialized
+                if new_item == top or new_item in materialized:
+                    break
+
+                materialized.add(new_item)
+
+                child = new_item
+                src_state_idx = new_item >> self._item_shift
+                symbol = self.grammar.dotted_lhs[new_item & self._item_mask]
+
+    def _item_rule(self, item):
+        return self.rules[self.grammar.dotted_rule[item & self._item_mask]]
+
+    def _traceback_create_forest(self, chart, target, state_idx, src_idx=0):
+        completed_sets = {}
+
+        def __completed(state_idx):
+            #Index the completed items of a state set by the source state and left hand side symbol.
+            #Empty spans are left out, since empty derivations leave no nodes.
+            if state_idx in completed_sets:
+                return completed_sets[state_idx]
+
+            if state_idx in chart.leo_entries:
+                self._leo_unfold(chart, state_idx)
+
+            completed = {}
+
+            for items in (chart.state_sets[state_idx], chart.leo_completed.get(state_idx, ())):
+                for item in items:
+                    dotted_rule = item & self._item_mask
+                    src_state_idx = item >> self._item_shift
+
+                    if self.grammar.dotted_next[dotted_rule] < 0 and src_state_idx != state_idx:
+                        key = (self._item_rule(item)[0], src_state_idx)
 
-                if it is not None:
-                    cur_item, cur_state_idx = it
+                        if key not in completed:
+                            completed[key] = []
 
-                    if isinstance(cur_item, Item):
-                        __traceback_expand(cur_item, cur_state_idx, cache)
+                        completed[key].append(item)
 
-                for trace in traces:
-                    new_trace = copy.copy(trace)
+            completed_sets[state_idx] = completed
 
-                    if it is not None:
-                        new_trace = new_trace + (it, )
+            return completed
 
-                    candidates.add(new_trace)
+        nodes = {}
+        sequences = {}
+        #nodes whose packed alternatives are not added yet
+        pending = []
 
-            cache[(item, state_idx)] = candidates
+        def __traceback_child(it, state_idx):
+            #the node of the symbol that moved the dot, or None for skipped nullable symbols
+            if it is None:
+                return None
 
-            return candidates
+            cur_item, cur_state_idx = it
 
-        def __traceback_create_tree(cache, item, state_idx):
-            if isinstance(item, Item):
-                rule = self.rules[item.rule_idx]
-                symbol = rule[0]
+            if isinstance(cur_item, int):
+                return __traceback_node(self._item_rule(cur_item)[0], cur_item >> self._item_shift, cur_state_idx)
+
+            symbol, token = cur_item
+
+            return __traceback_leaf(symbol, token, cur_state_idx, state_idx)
+
+        def __traceback_sequences(item, state_idx):
+            #All the child node sequences of the item's rhs up to its dot, as (sequence, number of derivations) pairs;
+            #derivations skipping empty symbols at different places give the same sequence.
+            #The sequences of the item's prefixes are computed first, with an explicit stack instead of recursion.
+            stack = [(item, state_idx)]
+
+            while stack:
+                key = stack[-1]
+
+                if key in sequences:
+                    stack.pop()
+                    continue
+
+                paths = self._traceback_paths(chart, key[0], key[1])
+                missing = [ref for it, ref in paths if ref is not None and ref not in sequences]
+
+                if missing:
+                    stack.extend(missing)
+                    continue
+
+                stack.pop()
                 candidates = []
+                counts = {}
+                #completed items of the same child node leave a back-pointer each, but make a single derivation here
+                visited = set()
 
-                c = cache[(item, state_idx)]
+                for it, ref in paths:
+                    prefixes = [(tuple(), 1)] if ref is None else sequences[ref]
+                    child = __traceback_child(it, key[1])
 
-                for trace in c:
-                    children = []
-                    for c, next_idx in trace:
-                        node = __traceback_create_tree(cache, c, next_idx)
-                        children.append(node)
+                    if (child, ref) in visited:
+                        continue
 
-                    candidates.append(children)
+                    visited.add((child, ref))
 
-                return {"type": "internal", "rule": rule, "symbol": symbol, "children": candidates}
+                    for prefix, count in prefixes:
+                        sequence = prefix if child is None else prefix + (child, )
 
-            else:
-                symbol, token = item
-                return {"type": "leaf", "symbol": symbol, "token": token}
+                        if sequence not in counts:
+                            counts[sequence] = 0
+                            candidates.append(sequence)
 
-        def __iter_nested_list(ll):
-            if len(ll) == 0:
-                return []
+                        counts[sequence] += count
 
-            if len(ll) == 1:
-                return [[i] for i in ll[0]]
+                sequences[key] = [(sequence, counts[sequence]) for sequence in candidates]
 
-            it = __iter_nested_list(ll[:-1])
-            new_it = [j + [i] for i in ll[-1] for j in it]
+            return sequences[(item, state_idx)]
 
-            return new_it
+        def __traceback_leaf(symbol, token, start, end):
+            #lattice arcs can span several positions
+            key = (symbol, start, end)
 
-        def __traceback_list(candidate_tree):
-            if candidate_tree["type"] == "leaf":
+            if key not in nodes:
+                nodes[key] = TerminalNode(symbol, token, start, end)
 
-                if "children" in candidate_tree:
-                    candidate_tree["children"] = []
+            return nodes[key]
 
-                return {LeafNode(candidate_tree["symbol"], candidate_tree["token"])}
+        def __traceback_node(symbol, src_idx, state_idx):
+            #Nodes are created on first reference, and their packed alternatives are added later on,
+            #so that children (even those of cyclic derivations) never wait for their parents.
+            key = (symbol, src_idx, state_idx)
 
-            if len(candidate_tree["rule"]) == 1:
-                return set()
+            if key in nodes:
+                return nodes[key]
 
-            candidates = candidate_tree["children"]
-            results = set()
+            node = SymbolNode(symbol, src_idx, state_idx)
+            nodes[key] = node
+            pending.append(node)
 
-            for candidate in candidates:
-                candidate_listed = [__traceback_list(c) for c in candidate]
-                candidate_listed = [l for l in candidate_listed if len(l) > 0]
-                comb = __iter_nested_list(candidate_listed)
-                for c in comb:
-                    node_obj = InternalNode(candidate_tree["rule"], c)
-                    results.add(node_obj)
+            if chart.budget is not None:
+                chart.budget.check_forest(len(nodes))
 
-            return results
+            return node
 
-        cache = {}
-        __traceback_expand(item, state_idx, cache)
-        candidate_trees = __traceback_create_tree(cache, item, state_idx)
-        results = __traceback_list(candidate_trees)
+        def __traceback_packed(node):
+            candidates = set()
 
-        return results
+            for item in __completed(node.end)[(node.symbol, node.start)]:
+                rule = self._item_rule(item)
 
-    def parse(self, tokens, target_symbol, should_traceback=True, debug=False):
-        state_sets = [set() for i in range(len(tokens) + 1)]
+                for sequence, count in __traceback_sequences(item, node.end):
+                    if (rule, sequence) not in candidates:
+                        candidates.add((rule, sequence))
+                        node.add_packed(rule, sequence, count)
 
-        self._traceback = {}
+        if (target, src_idx) not in __completed(state_idx):
+            return None
 
-        for i, r in enumerate(self.rules):
-            item = Item(0, 0, i) #an item is a tuple of dot index, source state index, and the rule index (in self.rules)
-            state_sets[0].add(item)
+        root = __traceback_node(target, src_idx, state_idx)
 
-            self._traceback_init(item, 0)
+        while pending:
+            __traceback_packed(pending.pop())
 
-        for cur_state_idx, state_set in enumerate(state_sets):
-            if cur_state_idx >= len(tokens):
-                token = None
-            else:
-                token = tokens[cur_state_idx]
+        return Forest(root)
 
-            cur_state_set = state_set
+    def _scan_table(self, tokens):
+        """
+        Maps every input position to the tokens that can be scanned there, as {terminal id: [(token, end position)]}.
+        Tokens are either a `Lattice`, or a list whose elements are single tokens or collections of candidate tokens
+        (dictionaries of candidate tokens to their weights included).
+        Tokens outside of the grammar are left out, since they can never be scanned.
+        """
+        table = [{} for i in range(len(tokens) + 1)]
 
-            while True:
-                new_items = []
+        if isinstance(tokens, Lattice):
+            arcs = tokens.arcs()
+        else:
+            arcs = ((i, candidate, i + 1)
+                    for i, element in enumerate(tokens)
+                    for candidate, weight in _iter_candidates(element))
 
-                for item in cur_state_set:
-                    dot_idx = item[0] #zero index; max at len(rhs)
-                    src_state_idx = item[1]
-                    rule_idx = item[2]
-                    rule = self.rules[rule_idx]
+        for start, token, end in arcs:
+            self._add_scan(table[start], token, end)
 
-                    lhs = rule[0]
-                    rhs = rule[1:]
+        return table
 
-                    #Encountered completed item
-                    if dot_idx >= len(rhs):
-                        for it in state_sets[src_state_idx]:
-                            it_r = self.rules[it.rule_idx]
+    def _add_scan(self, scans, token, end):
+        token_id = self.grammar.terminal_ids.get(token)
 
-                            #Check if the dot is placed at the left of target non-terminal symbol.
-                            if it.dot_idx < len(it_r) - 1 and it_r[it.dot_idx + 1] == lhs:
-                                new_item = Item(it.dot_idx + 1, it.src_idx, it.rule_idx)
-                                self._traceback_add(new_item, cur_state_idx, (item, cur_state_idx), it, src_state_idx)
+        if token_id is None:
+            return
 
-                                new_items.append(new_item)
+        if token_id not in scans:
+            scans[token_id] = []
 
-                    #Token is none only when the outer loop is at the last iteration.
-                    elif token is not None:
-                        cur_symbol = rhs[dot_idx]
-                        #Encountered terminal node: scan
-                        if cur_symbol in self.vocab_terminal:
-                            if cur_symbol == token:
-                                new_item = Item(dot_idx + 1, src_state_idx, rule_idx)
-                                self._traceback_add(new_item, cur_state_idx + 1, ((cur_symbol, token), cur_state_idx), item, cur_state_idx)
+        if (token, end) not in scans[token_id]:
+            scans[token_id].append((token, end))
 
-                                state_sets[cur_state_idx + 1].add(new_item)
+    def _new_chart(self, target_symbol, n_state_sets=1, cancel_event=None, lookahead=None, budget=None):
+        chart = _Chart(n_state_sets, cancel_event, budget)
 
-                        #Encountered nonterminal node: predict
-                        elif cur_symbol in self.vocab_nonterminal:
-                            for new_ridx in self.rule_dict[cur_symbol]:
-                                new_item = Item(0, cur_state_idx, new_ridx)
-                                new_items.append(new_item)
+        #Seed only the rules reachable by predicting the target symbol, if any
+        target = self.grammar.symbol_ids.get(self.grammar.name_of(target_symbol)) if target_symbol is not None else None
 
-                                self._traceback_init(new_item, cur_state_idx)
+        if target is not None:
+            chart.state_sets[0].update(self._predictions(target, lookahead))
+            chart.seed_predicted.update(self.grammar.closure_symbols[target])
 
-                    for r_idx in self.empty_rules:
-                        rule = self.rules[r_idx]
-                        lhs = rule[0]
-                        item = Item(0, cur_state_idx, r_idx)
+        return chart
 
-                        self._traceback_init(item, cur_state_idx)
+    def _predictions(self, symbol, lookahead):
+        #The dotted rules predicted by a nonterminal symbol.
+        #Given the terminal ids that can be scanned next, rules that can neither start with one of them nor derive
+        #the empty string are left out: they could never advance.
+        closure = self.grammar.closure[symbol]
 
-                        for it in state_sets[cur_state_idx]:
-                            it_r = self.rules[it.rule_idx]
+        if lookahead is None:
+            return closure
 
-                            # Check if the dot is placed at the left of target non-terminal symbol.
-                            if it.dot_idx < len(it_r) - 1 and it_r[it.dot_idx + 1] == lhs:
-                                new_item = Item(it.dot_idx + 1, it.src_idx, it.rule_idx)
+        #a single candidate token, as in plain token lists: the filtered closure is precomputed
+        if len(lookahead) == 1:
+            for terminal in lookahead:
+                return self.grammar.lookahead_closure[symbol].get(terminal, self.grammar.empty_closure[symbol])
 
-                                self._traceback_add(new_item, cur_state_idx, (item, cur_state_idx), it, cur_state_idx)
+        dotted_first = self.grammar.dotted_first
 
-                                new_items.append(new_item)
+        return [dotted_rule for dotted_rule in closure
+                if dotted_first[dotted_rule] is None or not dotted_first[dotted_rule].isdisjoint(lookahead)]
 
-                if not new_items:
-                    break
+    def _build_chart(self, tokens, target_symbol, debug=False, cancel_event=None, stats=None, budget=None, recover=False, seeds=()):
+        start = timer()
+        scan_table = self._scan_table(tokens)
+        chart = self._new_chart(target_symbol, len(scan_table), cancel_event, scan_table[0] if self.lookahead else None, budget)
+        chart.stats = stats
 
-                #it's time to process a new set of items.
-                #but which are really new?
-                next_items = set()
-                for item in new_items:
-                    if item in state_set:
-                        continue
+        for cur_state_idx, cur_scans in enumerate(scan_table):
+            chart.check_cancelled()
+
+            if seeds and cur_scans:
+                self._seed_state_set(chart, cur_state_idx, seeds, cur_scans if self.lookahead else None)
+
+            #there is nothing to scan at the last state set, so nothing is predicted there
+            self._close_state_set(chart, cur_state_idx, bool(cur_scans), debug, cur_scans if self.lookahead else None)
+
+            if recover:
+                self._recover_state_set(chart, target_symbol, cur_state_idx, cur_scans)
+
+            chart.close_state_set(cur_state_idx)
+
+            if stats is not None:
+                stats._record_state_set(self, chart, cur_state_idx)
+
+            self._scan_state_set(chart, cur_state_idx, cur_scans)
+
+        if stats is not None:
+            stats._add_time("chart", timer() - start)
+
+        return chart
+
+    def _chart_forest(self, chart, target_symbol):
+        #the forest of the parses spanning the whole chart, or None
+        start = timer()
+        forest = self._traceback_create_forest(chart, self.grammar.name_of(target_symbol), len(chart.state_sets) - 1)
+
+        if chart.stats is not None:
+            chart.stats._add_time("forest", timer() - start)
+            chart.stats.forest_nodes += len(forest) if forest is not None else 0
+
+        return forest
+
+    def _close_state_set(self, chart, cur_state_idx, should_predict=True, debug=False, lookahead=None, agenda=None):
+        #Completes the state set: runs the completer and the predictor until no item is added.
+        #Predictions are filtered by the `lookahead` terminal ids, if given.
+        #An `agenda` only processes the given items, which were just added to an already closed state set.
+        shift = self._item_shift
+        mask = self._item_mask
+        dotted_next = self.grammar.dotted_next
+        dotted_lhs = self.grammar.dotted_lhs
+        is_terminal = self.grammar.is_terminal
+        is_nullable = self.grammar.is_nullable
+        traceback = chart.traceback[cur_state_idx]
+        waiting = chart.waiting
+        leo = chart.leo
+        state_set = chart.state_sets[cur_state_idx]
+
+        #nonterminal symbol ids whose prediction closure was already added to the state set
+        predicted = chart.seed_predicted if cur_state_idx == 0 else set()
+
+        cur_waiting = waiting[cur_state_idx]
+        cur_src = cur_state_idx << shift
+
+        if agenda is None:
+            agenda = list(state_set)
+
+        #items left before the next check of the budget; never reaches 0 without a budget
+        countdown = _BUDGET_CHECK_INTERVAL if chart.budget is not None else -1
+
+        while agenda:
+            item = agenda.pop()
+            countdown -= 1
+
+            if countdown == 0:
+                chart.check_cancelled()
+                chart.budget.check(len(state_set))
+                countdown = _BUDGET_CHECK_INTERVAL
+
+            dotted_rule = item & mask
+            cur_symbol = dotted_next[dotted_rule]
+
+            #Encountered completed item
+            if cur_symbol < 0:
+                src_state_idx = item >> shift
+
+                #Empty completions were already handled by skipping nullable symbols at prediction time
+                if src_state_idx == cur_state_idx:
+                    continue
+
+                lhs = dotted_lhs[dotted_rule]
+                path = leo[src_state_idx][lhs] if lhs in leo[src_state_idx] else self._leo_path(leo, waiting, src_state_idx, lhs)
+
+                #Leo: jump to the top of the deterministic reduction path, the items in between are materialized on demand
+                if path is not None:
+                    top = path[1]
+
+                    if cur_state_idx not in chart.leo_entries:
+                        chart.leo_entries[cur_state_idx] = []
 
-                    state_set.add(item)
-                    next_items.add(item)
+                    chart.leo_entries[cur_state_idx].append(item)
 
-                #swap out the state set for the next iteration.
-                cur_state_set = next_items
+                    if top not in state_set:
+                        state_set.add(top)
+                        agenda.append(top)
 
-            if debug:
-                print("==={}===".format(cur_state_idx))
-                for i, item in enumerate(state_set):
-                    print("{}. {}".format(i + 1, self.visualize(item)))
+                    continue
 
+                for it in waiting[src_state_idx].get(lhs, ()):
+                    new_item = it + 1
 
-        final_items = []
+                    if new_item not in traceback:
+                        traceback[new_item] = []
+
+                    traceback[new_item].append(((item, cur_state_idx), (it, src_state_idx)))
+
+                    if new_item not in state_set:
+                        state_set.add(new_item)
+                        agenda.append(new_item)
 
-        for item in state_sets[-1]:
-            if item.src_idx != 0:
                 continue
 
-            rule = self.rules[item.rule_idx]
+            #Index the item by the symbol at the right of its dot, so that completion and scanning only touch items that can advance
+            if cur_symbol not in cur_waiting:
+                cur_waiting[cur_symbol] = []
 
-            if rule[0] == target_symbol.name and item.dot_idx >= len(rule) - 1:
-                final_items.append(item)
+            cur_waiting[cur_symbol].append(item)
 
-        if should_traceback:
-            trees = [self._traceback_create_tree(item, len(tokens)) for item in final_items]
-            trees = [t for tree_l in trees for t in tree_l]
+            #Encountered terminal node: scanned once the state set is closed
+            if is_terminal[cur_symbol]:
+                continue
+
+            #Encountered nonterminal node: predict
+            if should_predict and cur_symbol not in predicted:
+                predicted.update(self.grammar.closure_symbols[cur_symbol])
+
+                for dotted_rule in self._predictions(cur_symbol, lookahead):
+                    new_item = cur_src | dotted_rule
+
+                    if new_item not in state_set:
+                        state_set.add(new_item)
+                        agenda.append(new_item)
+
+            #Aycock-Horspool: skip over nullable symbols right away.
+            #Empty derivations leave no nodes in the tree, so no child is recorded for them.
+            if is_nullable[cur_symbol]:
+                new_item = item + 1
+
+                if new_item not in traceback:
+                    traceback[new_item] = []
+
+                traceback[new_item].append((None, (item, cur_state_idx)))
+
+                if new_item not in state_set:
+                    state_set.add(new_item)
+                    agenda.append(new_item)
+
+        if debug:
+            print("==={}===".format(cur_state_idx))
+            for i, item in enumerate(state_set):
+                print("{}. {}".format(i + 1, self.visualize(item)))
+
+    def _seed_state_set(self, chart, cur_state_idx, seeds, lookahead):
+        #Infix parsing: predicts the seed symbol ids in the state set before it is closed,
+        #so that their constituents starting at the position are parsed whatever comes before it.
+        state_set = chart.state_sets[cur_state_idx]
+        cur_src = cur_state_idx << self._item_shift
+
+        for symbol in seeds:
+            #as at the start of the input, no path of Leo's goes through a seed symbol
+            chart.leo[cur_state_idx][symbol] = None
+            state_set.update(cur_src | dotted_rule for dotted_rule in self._predictions(symbol, lookahead))
+
+    def _recover_state_set(self, chart, target_symbol, cur_state_idx, cur_scans):
+        #Error recovery: where the parse cannot go on, that is, where no item of the closed state set scans a token
+        #and no token scanned before reaches beyond, the target symbol is predicted again,
+        #so that the constituents after the error are parsed as well.
+        #Positions of tokens outside of the grammar have nothing to scan; the last one never has.
+        if cur_state_idx == len(chart.state_sets) - 1 or any(token_id in chart.waiting[cur_state_idx] for token_id in cur_scans):
+            return
+
+        if any(chart.state_sets[cur_state_idx + 1:]):
+            return
+
+        if chart.failure is None:
+            chart.failure = (cur_state_idx, self._expected_terminals(chart, target_symbol, cur_state_idx))
+
+        target = self.grammar.symbol_ids.get(self.grammar.name_of(target_symbol))
+
+        if target is None:
+            return
+
+        #as at the start of the input, no path of Leo's goes through the restarted target symbol
+        chart.leo[cur_state_idx][target] = None
+
+        state_set = chart.state_sets[cur_state_idx]
+        cur_src = cur_state_idx << self._item_shift
+        agenda = [cur_src | dotted_rule for dotted_rule in self._predictions(target, cur_scans if self.lookahead else None)
+                  if cur_src | dotted_rule not in state_set]
+
+        state_set.update(agenda)
+        self._close_state_set(chart, cur_state_idx, True, False, cur_scans if self.lookahead else None, agenda)
+
+    def _expected_terminals(self, chart, target_symbol, state_idx):
+        #Terminal symbols the items of the closed state set can scan next, predictions left out by lookahead included
+        grammar = self.grammar
+        expected = set()
+
+        #the target symbol is predicted without any item waiting for it
+        if state_idx == 0 and grammar.name_of(target_symbol) in grammar.first:
+            expected.update(grammar.first[grammar.name_of(target_symbol)])
+
+        for symbol_id in chart.waiting[state_idx]:
+            symbol = grammar.symbols[symbol_id]
+
+            if grammar.is_terminal[symbol_id]:
+                expected.add(symbol)
+            else:
+                expected.update(grammar.first[symbol])
 
-            graph_builder = GraphBuilder()
+        return sorted(expected)
 
-            ret = []
-            for t in trees:
-                tree = graph_builder.build(t)
-                ret.append(tree)
+    def _scan_state_set(self, chart, cur_state_idx, cur_scans):
+        #Scans the tokens of the position from the items of the (closed) state set waiting for them.
+        #Scanning the token of a lattice arc moves the item to the state set at the end of the arc.
+        cur_waiting = chart.waiting[cur_state_idx]
+
+        for token_id, arcs in cur_scans.items():
+            items = cur_waiting.get(token_id)
+
+            if not items:
+                continue
+
+            symbol = self.grammar.symbols[token_id]
+
+            for token, end in arcs:
+                chart.extend(end + 1)
+                state_set = chart.state_sets[end]
+                traceback = chart.traceback[end]
+
+                for item in items:
+                    new_item = item + 1
+
+                    if new_item not in traceback:
+                        traceback[new_item] = []
+
+                    traceback[new_item].append((((symbol, token), cur_state_idx), (item, cur_state_idx)))
+
+                    state_set.add(new_item)
+
+    def _final_items(self, state_set, target_symbol):
+        target = self.grammar.symbol_ids.get(self.grammar.name_of(target_symbol))
+
+        for item in state_set:
+            dotted_rule = item & self._item_mask
+
+            if item >> self._item_shift == 0 and self.grammar.dotted_next[dotted_rule] < 0 and self.grammar.dotted_lhs[dotted_rule] == target:
+                yield item
+
+    def recognize(self, tokens, target_symbol, cancel_event=None, budget=None, stats=None):
+        """
+        Tells whether the tokens can be derived from the target symbol.
+        Unlike `parse`, no back-pointers are recorded,
+        and only the per-symbol indices of past state sets are kept.
+        A `ParseStats` given gets the counts of every state set, without back-pointers.
+        """
+        start = timer()
+        shift = self._item_shift
+        mask = self._item_mask
+        dotted_next = self.grammar.dotted_next
+        dotted_lhs = self.grammar.dotted_lhs
+        is_terminal = self.grammar.is_terminal
+        is_nullable = self.grammar.is_nullable
+
+        target = self.grammar.symbol_ids.get(self.grammar.name_of(target_symbol))
+
+        if target is None:
+            return False
+
+        scan_table = self._scan_table(tokens)
+        waiting = []
+        leo = []
+        tracker = _BudgetTracker(budget) if budget is not None else None
+        predicted = set(self.grammar.closure_symbols[target])
+
+        #items scanned into each state set, before it is processed
+        scanned = [[] for i in range(len(scan_table))]
+        scanned[0].extend(self._predictions(target, scan_table[0] if self.lookahead else None))
+        last_scanned = 0
+
+        for cur_state_idx, cur_scans in enumerate(scan_table):
+            #Nothing was scanned up to here or beyond: no item can reach the end of the input
+            if last_scanned < cur_state_idx:
+                return False
+
+            if cancel_event is not None and cancel_event.is_set():
+                raise ParseCancelled()
+
+            if cur_state_idx > 0:
+                predicted = set()
+
+            #derivations of items by scanning, completing, skipping a nullable symbol and jumping a Leo path
+            n_scanned = len(scanned[cur_state_idx]) if cur_state_idx > 0 else 0
+            n_completed, n_skipped, n_leo = 0, 0, 0
+            state_set = set(scanned[cur_state_idx])
+            scanned[cur_state_idx] = None
+            agenda = list(state_set)
+            cur_waiting = {}
+            waiting.append(cur_waiting)
+            leo.append({})
+            cur_src = cur_state_idx << shift
+            countdown = _BUDGET_CHECK_INTERVAL if tracker is not None else -1
+
+            while agenda:
+                item = agenda.pop()
+                countdown -= 1
+
+                if countdown == 0:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ParseCancelled()
+
+                    tracker.check(len(state_set))
+                    countdown = _BUDGET_CHECK_INTERVAL
+
+                dotted_rule = item & mask
+                cur_symbol = dotted_next[dotted_rule]
+
+                #Encountered completed item
+                if cur_symbol < 0:
+                    src_state_idx = item >> shift
+
+                    if src_state_idx == cur_state_idx:
+                        continue
+
+                    lhs = dotted_lhs[dotted_rule]
+                    path = leo[src_state_idx][lhs] if lhs in leo[src_state_idx] else self._leo_path(leo, waiting, src_state_idx, lhs)
+
+                    if path is not None:
+                        n_leo += 1
+
+                        if path[1] not in state_set:
+                            state_set.add(path[1])
+                            agenda.append(path[1])
+
+                        continue
+
+                    completed = waiting[src_state_idx].get(lhs, ())
+                    n_completed += len(completed)
+
+                    for it in completed:
+                        new_item = it + 1
+
+                        if new_item not in state_set:
+                            state_set.add(new_item)
+                            agenda.append(new_item)
+
+                    continue
+
+                if cur_symbol not in cur_waiting:
+                    cur_waiting[cur_symbol] = []
+
+                cur_waiting[cur_symbol].append(item)
+
+                #Encountered terminal node: scan
+                if is_terminal[cur_symbol]:
+                    for token, end in cur_scans.get(cur_symbol, ()):
+                        scanned[end].append(item + 1)
+                        last_scanned = max(last_scanned, end)
+
+                    continue
+
+                #Encountered nonterminal node: predict
+                if cur_scans and cur_symbol not in predicted:
+                    predicted.update(self.grammar.closure_symbols[cur_symbol])
+
+                    for dotted_rule in self._predictions(cur_symbol, cur_scans if self.lookahead else None):
+                        new_item = cur_src | dotted_rule
+
+                        if new_item not in state_set:
+                            state_set.add(new_item)
+                            agenda.append(new_item)
+
+                if is_nullable[cur_symbol]:
+                    n_skipped += 1
+                    new_item = item + 1
+
+                    if new_item not in state_set:
+                        state_set.add(new_item)
+                        agenda.append(new_item)
+
+            #the state set is closed; no back-pointers are recorded
+            if tracker is not None:
+                tracker.close_state_set(len(state_set), 0)
+
+            if stats is not None:
+                stats._record_recognized_state_set(self, state_set, cur_state_idx, n_scanned, n_completed, n_skipped, n_leo)
+
+        if stats is not None:
+            stats._add_time("chart", timer() - start)
+
+        return any(True for item in self._final_items(state_set, target_symbol))
+
+    def parse(self, tokens, target_symbol, should_traceback=True, debug=False, cancel_event=None, prune_temp=False, stats=None, budget=None):
+        """
+        Parses the tokens into trees, without the nodes of the temporary symbols of the grammar if `prune_temp`.
+        Parses are reentrant: all their state is kept in their own chart.
+        A parse given a `cancel_event` (such as a `threading.Event`) checks it between state sets and between trees,
+        and raises ParseCancelled once it is set.
+        A parse given a `ParseStats` records its counts and timings in it; the other methods take one as well.
+        A parse given a `ParseBudget` raises BudgetExceeded once it runs out of it, as do the other methods;
+        when it runs out of trees, the exception holds the trees built until then.
+        """
+        if not should_traceback and not debug:
+            return self.recognize(tokens, target_symbol, cancel_event, budget, stats)
+
+        chart = self._build_chart(tokens, target_symbol, debug, cancel_event, stats, budget)
+
+        if should_traceback:
+            ret = self._chart_trees(chart, target_symbol, self.grammar.temp_symbols if prune_temp else ())
         else:
-            ret = len(final_items) > 0
+            ret = any(True for item in self._final_items(chart.state_sets[-1], target_symbol))
 
         # Clean up
-        del state_sets
+        del chart
+
+        return ret
+
+    def _chart_trees(self, chart, target_symbol, temp_symbols=()):
+        #the trees of the parses spanning the whole chart
+        forest = self._chart_forest(chart, target_symbol)
+
+        if forest is None:
+            return []
+
+        start = timer()
+
+        ret = []
+        for derivation in forest.derivations():
+            chart.check_cancelled()
+
+            if chart.budget is not None:
+                chart.budget.check_trees(len(ret), ret)
+
+            ret.append(self._derivation_tree(derivation, temp_symbols))
+
+        if chart.stats is not None:
+            chart.stats._add_time("trees", timer() - start)
+            chart.stats.trees += len(ret)
+
+        return ret
+
+    def parse_partial(self, tokens, target_symbol, debug=False, cancel_event=None, prune_temp=False, stats=None, budget=None):
+        """
+        Parses the tokens with error recovery, and returns a `PartialParse` of the chart:
+        the longest prefix derived from the target symbol, the first position the parse could not go on from
+        with the terminals expected there, and the fewest constituents covering the input.
+        For inputs that can be derived, the trees of the prefix are the trees `parse` returns.
+        """
+        chart = self._build_chart(tokens, target_symbol, debug, cancel_event, stats, budget, recover=True)
+
+        return PartialParse(self, chart, target_symbol, self.grammar.temp_symbols if prune_temp else ())
+
+    def parse_spans(self, tokens, symbols=None, debug=False, cancel_event=None, prune_temp=False, stats=None, budget=None):
+        """
+        Parses all the substrings of the tokens in a single chart, by predicting the symbols at every position,
+        and returns a `SpanChart` of the constituents found there, whose trees are built on demand.
+        Symbols, either a single one or a list, default to all the nonterminal symbols of the grammar;
+        constituents of other symbols are only found where the given ones predict them.
+        """
+        grammar = self.grammar
+
+        if symbols is None:
+            symbols = sorted(grammar.vocab_nonterminal.difference(grammar.temp_symbols))
+        elif not isinstance(symbols, (list, tuple, set, frozenset)):
+            symbols = [symbols]
+
+        seeds = [grammar.symbol_ids[name] for name in (grammar.name_of(symbol) for symbol in symbols)
+                 if name in grammar.vocab_nonterminal]
+
+        chart = self._build_chart(tokens, None, debug, cancel_event, stats, budget, seeds=seeds)
+
+        return SpanChart(self, chart, self.grammar.temp_symbols if prune_temp else ())
+
+    def session(self, target_symbol):
+        """
+        Starts a parse session, to which tokens are fed one at a time
+        """
+        return ParseSession(self, target_symbol)
+
+    def parse_forest(self, tokens, target_symbol, debug=False, cancel_event=None, stats=None, budget=None):
+        """
+        Parses the tokens into a shared packed parse forest, or None if they cannot be derived from the target symbol.
+        Unlike the trees returned by `parse`, the forest does not enumerate ambiguities,
+        so its size stays polynomial in the number of tokens.
+        """
+        chart = self._build_chart(tokens, target_symbol, debug, cancel_event, stats, budget)
+
+        forest = self._chart_forest(chart, target_symbol)
+
+        # Clean up
+        del chart
+
+        return forest
+
+    def count_parses(self, tokens, target_symbol, debug=False, cancel_event=None, stats=None, budget=None):
+        """
+        Counts the derivations of the tokens from the target symbol in the grammar, without building them.
+        Without cycles these are the trees `parse` returns.
+        Grammars deriving a symbol from itself over a span have infinitely many derivations, counted as float('inf'),
+        while `parse` only returns the trees that do not repeat a node under itself.
+        """
+        forest = self.parse_forest(tokens, target_symbol, debug, cancel_event, stats, budget)
+
+        if forest is None:
+            return 0
+
+        start = timer()
+        ret = forest.count_trees()
+
+        if stats is not None:
+            stats._add_time("count", timer() - start)
+
+        return ret
+
+    def is_ambiguous(self, tokens, target_symbol, debug=False, cancel_event=None, stats=None, budget=None):
+        """
+        Tells whether the tokens have more than one derivation from the target symbol in the grammar,
+        as `count_parses` counts them: cyclic derivations are infinitely many, even when `parse` returns a single tree.
+        """
+        forest = self.parse_forest(tokens, target_symbol, debug, cancel_event, stats, budget)
+
+        return forest is not None and forest.is_ambiguous
+
+    def iter_parses(self, tokens, target_symbol, max_trees=None, first_only=False, debug=False, cancel_event=None, prune_temp=False, stats=None, budget=None):
+        """
+        Yields the same trees as `parse`, one at a time.
+        Trees are enumerated from the parse forest on demand, so stopping early skips the rest of the enumeration.
+        Unlike `max_trees`, which ends the enumeration quietly, the trees of a `budget` raise BudgetExceeded.
+        """
+        if first_only:
+            max_trees = 1
+
+        chart = self._build_chart(tokens, target_symbol, debug, cancel_event, stats, budget)
+        forest = self._chart_forest(chart, target_symbol)
+        tracker = chart.budget
+        del chart
+
+        if forest is None or max_trees == 0:
+            return
+
+        temp_symbols = self.grammar.temp_symbols if prune_temp else ()
+        n_trees = 0
+        start = timer()
+
+        for derivation in forest.derivations():
+            if cancel_event is not None and cancel_event.is_set():
+                raise ParseCancelled()
+
+            if tracker is not None:
+                tracker.check_trees(n_trees)
+
+            tree = self._derivation_tree(derivation, temp_symbols)
+            n_trees += 1
+
+            #only the time spent building the trees is recorded, not the time the caller spends on them
+            if stats is not None:
+                stats._add_time("trees", timer() - start)
+                stats.trees += 1
+
+            yield tree
+            start = timer()
+
+            if max_trees is not None and n_trees >= max_trees:
+                return
+
+    def _nullable_weights(self, combine):
+        """
+        Weights of deriving the empty string from the nullable symbols, computed as a fixed point over the empty rules.
+        Symbols whose weights still change after `_MAX_NULLABLE_ITERATIONS` iterations diverge, and weigh float('inf').
+        """
+        rules = [(r_idx, rule) for r_idx, rule in enumerate(self.rules) if all(s in self.grammar.nullable for s in rule[1:])]
+        weights = {symbol: 0.0 for symbol in self.grammar.nullable}
+
+        for i in range(_MAX_NULLABLE_ITERATIONS):
+            new_weights = {symbol: 0.0 for symbol in self.grammar.nullable}
+
+            for r_idx, rule in rules:
+                w = self.grammar.rule_weights[r_idx]
+
+                for symbol in rule[1:]:
+                    w *= weights[symbol]
+
+                if combine == "sum":
+                    new_weights[rule[0]] += w
+                else:
+                    new_weights[rule[0]] = max(new_weights[rule[0]], w)
+
+            diverging = [symbol for symbol in weights if abs(new_weights[symbol] - weights[symbol]) > 1e-12]
+            weights = new_weights
+
+            if not diverging:
+                break
+        else:
+            for symbol in diverging:
+                weights[symbol] = float("inf")
+
+        return weights
+
+    def _weight_functions(self, tokens, combine):
+        #local weights of the forest nodes: rule weights, with the empty derivations left out of the forest, and token weights
+        if combine not in self._empty_weights:
+            self._empty_weights[combine] = self._nullable_weights(combine)
+
+        nullable_weights = self._empty_weights[combine]
+        lattice = tokens if isinstance(tokens, Lattice) else Lattice(tokens)
+
+        def __packed_weight(node, packed):
+            weight = self._rule_weights[packed.rule]
+
+            #the rhs symbols without a child node were derived empty
+            if len(packed.children) < len(packed.rule) - 1:
+                skipped = list(packed.rule[1:])
+
+                for child in packed.children:
+                    skipped.remove(child.symbol)
+
+                for symbol in skipped:
+                    if nullable_weights[symbol] == float("inf"):
+                        raise CyclicForestError("the empty derivations of {} are infinitely many".format(symbol))
+
+                    weight *= nullable_weights[symbol]
+
+            return weight
+
+        def __terminal_weight(node):
+            return lattice.weight(node.start, node.token, node.end)
+
+        return __packed_weight, __terminal_weight
+
+    def inside_probability(self, tokens, target_symbol, debug=False, cancel_event=None, stats=None, budget=None):
+        """
+        Sums the weights of the parses of the tokens, the weight of a parse being the product of its rule and token weights.
+        With rule probabilities, this is the inside probability of the input (Stolcke, 1995):
+        derivations that only differ in where empty symbols were skipped are all counted, although they make the same tree.
+        Raises CyclicForestError when a symbol derives itself over a span, or when the weights of the empty derivations
+        of a skipped symbol diverge, since the parses are infinitely many.
+        """
+        forest = self.parse_forest(tokens, target_symbol, debug, cancel_event, stats, budget)
+
+        if forest is None:
+            return 0.0
+
+        start = timer()
+        ret = forest.inside(*self._weight_functions(tokens, "sum"))
+
+        if stats is not None:
+            stats._add_time("inside", timer() - start)
+
+        return ret
+
+    def k_best_parses(self, tokens, target_symbol, k=1, debug=False, cancel_event=None, prune_temp=False, stats=None, budget=None):
+        """
+        Returns the k parses of highest weight, best first, as (tree, weight) pairs.
+        Parses are ranked in the parse forest, so no other parse is built.
+        Raises CyclicForestError as `inside_probability` does.
+        """
+        forest = self.parse_forest(tokens, target_symbol, debug, cancel_event, stats, budget)
+
+        if forest is None or k <= 0:
+            return []
+
+        start = timer()
+        derivations = forest.k_best(k, *self._weight_functions(tokens, "max"))
+        temp_symbols = self.grammar.temp_symbols if prune_temp else ()
+
+        if stats is not None:
+            stats._add_time("k_best", timer() - start)
+            start = timer()
+
+        ret = [(self._derivation_tree(derivation, temp_symbols), weight) for weight, derivation in derivations]
+
+        if stats is not None:
+            stats._add_time("trees", timer() - start)
+            stats.trees += len(ret)
+
+        return ret
+
+    def best_parse(self, tokens, target_symbol, debug=False, cancel_event=None, prune_temp=False, stats=None, budget=None):
+        """
+        Returns the (tree, weight) pair of the Viterbi parse, or None if the tokens cannot be derived from the target symbol
+        """
+        parses = self.k_best_parses(tokens, target_symbol, 1, debug, cancel_event, prune_temp, stats, budget)
+
+        return parses[0] if parses else None
+
+    def _derivation_tree(self, derivation, temp_symbols=()):
+        #the parse tree of a forest derivation; nodes span the input instead of copying its tokens.
+        #Nodes of temporary symbols are replaced by their children as the tree is built, except at the root.
+        #Once they are pruned, nodes report the rules of the grammar as written, rules rewritten by the grammar optimizer included;
+        #unpruned trees keep the rules of the compiled grammar, whose children they match.
+        rule_origins = self.grammar.rule_origins if temp_symbols else {}
+
+        def __leaf(node):
+            return ParseNode(node.symbol, node.start, node.end, token=node.token)
+
+        def __node(node, packed, children):
+            return ParseNode(node.symbol, node.start, node.end, rule_origins.get(packed.rule, packed.rule), children)
 
-        return ret
\ No newline at end of file
+        return fold_derivation(derivation, __leaf, __node, temp_symbols)
@@ -0,0 +1,454 @@
+#encoding: UTF-8
+
+import heapq
+
+# Shared packed parse forest (SPPF)
+# Every (symbol, start, end) span is represented by a single node,
+# and each way of deriving it is kept as a packed alternative of that node.
+# Nodes deriving themselves (e.g. through A -> A, or empty symbols) make cyclic forests, which pack infinitely many trees.
+
+class CyclicForestError(ValueError):
+    """
+    Raised when weighting the trees of a cyclic forest, since they are infinitely many
+    """
+    pass
+
+class TerminalNode(object):
+    def __init__(self, symbol, token, start, end=None):
+        self.symbol = symbol
+        self.token = token
+        self.start = start
+        self.end = start + 1 if end is None else end
+        self.parents = []
+
+    @property
+    def key(self):
+        return (self.symbol, self.start, self.end)
+
+    @property
+    def children(self):
+        return []
+
+    def __repr__(self):
+        return "TerminalNode ({}: {}) [{}, {})".format(self.symbol, self.token, self.start, self.end)
+
+class PackedNode(object):
+    def __init__(self, rule, children, multiplicity=1):
+        self.rule = rule
+        self.children = tuple(children)
+        #Number of derivations giving the same children, which only differ in where empty symbols were skipped
+        #(e.g. S -> A A, A -> a | ε over "a"). They make a single tree, but are weighted apart by `Forest.inside`.
+        self.multiplicity = multiplicity
+
+    def __repr__(self):
+        return "PackedNode ({} -> {}) ({} children)".format(self.rule[0], self.rule[1:], len(self.children))
+
+class SymbolNode(object):
+    def __init__(self, symbol, start, end, is_temp=False):
+        self.symbol = symbol
+        self.start = start
+        self.end = end
+        self.is_temp = is_temp
+        self.packed = []
+        self.parents = []
+
+    @property
+    def key(self):
+        return (self.symbol, self.start, self.end)
+
+    @property
+    def is_ambiguous(self):
+        return len(self.packed) > 1
+
+    @property
+    def children(self):
+        """
+        Child nodes over all packed alternatives, without duplicates
+        """
+        ret = []
+        visited = set()
+
+        for packed in self.packed:
+            for child in packed.children:
+                if child not in visited:
+                    visited.add(child)
+                    ret.append(child)
+
+        return ret
+
+    def add_packed(self, rule, children, multiplicity=1):
+        self.packed.append(PackedNode(rule, children, multiplicity))
+
+    def __repr__(self):
+        return "SymbolNode ({}) [{}, {}) ({} alternatives)".format(self.symbol, self.start, self.end, len(self.packed))
+
+class Forest(object):
+    def __init__(self, root):
+        self.root = root
+        self.nodes = {}
+        self._cyclic = None
+
+        #Collect the nodes reachable from the root and link them to their parents
+        stack = [root]
+        self.nodes[root.key] = root
+
+        while stack:
+            node = stack.pop()
+
+            for child in node.children:
+                child.parents.append(node)
+
+                if child.key not in self.nodes:
+                    self.nodes[child.key] = child
+                    stack.append(child)
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, key):
+        return key in self.nodes
+
+    def get(self, symbol, start, end):
+        return self.nodes.get((symbol, start, end))
+
+    @property
+    def is_ambiguous(self):
+        return any(isinstance(node, SymbolNode) and node.is_ambiguous for node in self)
+
+    @property
+    def is_cyclic(self):
+        """
+        Whether some node derives itself
+        """
+        if self._cyclic is None:
+            self._postorder()
+
+        return self._cyclic
+
+    def _postorder(self):
+        #Nodes ordered so that every node comes after its children, which only holds for acyclic forests.
+        #Cycles are detected on the way, as children still on the path from the root.
+        order = []
+        visited = set()
+        path = set()
+        cyclic = False
+        stack = [(self.root, False)]
+
+        while stack:
+            node, expanded = stack.pop()
+
+            if expanded:
+                path.remove(node)
+                order.append(node)
+                continue
+
+            if node in visited:
+                cyclic = cyclic or node in path
+                continue
+
+            visited.add(node)
+            path.add(node)
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+
+        self._cyclic = cyclic
+
+        return order
+
+    def _acyclic_postorder(self):
+        order = self._postorder()
+
+        if self._cyclic:
+            raise CyclicForestError("the forest of {} is cyclic".format(self.root))
+
+        return order
+
+    def count_trees(self):
+        """
+        Counts the trees packed in the forest without enumerating them.
+        Counts are computed bottom-up, once per node, with arbitrary precision.
+        Cyclic forests count float('inf') trees.
+        """
+        order = self._postorder()
+
+        if self._cyclic:
+            return float("inf")
+
+        counts = {}
+
+        for node in order:
+            if isinstance(node, TerminalNode):
+                counts[node] = 1
+                continue
+
+            count = 0
+
+            for packed in node.packed:
+                c = 1
+
+                for child in packed.children:
+                    c *= counts[child]
+
+                count += c
+
+            counts[node] = count
+
+        return counts[self.root]
+
+    def inside(self, packed_weight, terminal_weight):
+        """
+        Sums the weights of the derivations packed in the forest, the weight of a derivation being the product of its local weights.
+        `packed_weight(node, packed)` gives the weight of deriving a symbol node through one of its alternatives,
+        and `terminal_weight(node)` the weight of a terminal node. Alternatives count as many times as their multiplicity.
+        Raises CyclicForestError on cyclic forests.
+        """
+        inside = {}
+
+        for node in self._acyclic_postorder():
+            if isinstance(node, TerminalNode):
+                inside[node] = terminal_weight(node)
+                continue
+
+            total = 0.0
+
+            for packed in node.packed:
+                w = packed_weight(node, packed) * packed.multiplicity
+
+                for child in packed.children:
+                    w *= inside[child]
+
+                total += w
+
+            inside[node] = total
+
+        return inside[self.root]
+
+    def k_best(self, k, packed_weight, terminal_weight):
+        """
+        The k trees of highest weight, best first, as (weight, derivation) pairs,
+        where a derivation is either a terminal node or a (symbol node, packed node, child derivations) tuple.
+        Weights are as in `inside` and must not be negative.
+        The best lists of the children are merged bottom-up with a heap (Huang & Chiang, 2005),
+        so that at most k derivations are kept per node.
+        Raises CyclicForestError on cyclic forests.
+        """
+        best = {}
+
+        for node in self._acyclic_postorder():
+            if isinstance(node, TerminalNode):
+                best[node] = [(terminal_weight(node), node)]
+                continue
+
+            weights = [packed_weight(node, packed) for packed in node.packed]
+            results = []
+            heap = []
+            visited = set()
+
+            for i, packed in enumerate(node.packed):
+                ranks = (0, ) * len(packed.children)
+                visited.add((i, ranks))
+                heapq.heappush(heap, (-self._derivation_weight(best, weights[i], packed, ranks), i, ranks))
+
+            while heap and len(results) < k:
+                weight, i, ranks = heapq.heappop(heap)
+                packed = node.packed[i]
+                results.append((-weight, (node, packed, tuple(best[child][r][1] for child, r in zip(packed.children, ranks)))))
+
+                #the next best derivations of this alternative take the next best derivation of one of the children
+                for j, child in enumerate(packed.children):
+                    if ranks[j] + 1 < len(best[child]):
+                        new_ranks = ranks[:j] + (ranks[j] + 1, ) + ranks[j + 1:]
+
+                        if (i, new_ranks) not in visited:
+                            visited.add((i, new_ranks))
+                            heapq.heappush(heap, (-self._derivation_weight(best, weights[i], packed, new_ranks), i, new_ranks))
+
+            best[node] = results
+
+        return best[self.root]
+
+    def derivations(self, node=None):
+        """
+        Lazily enumerates the derivations of a node (the root by default), in the format of `k_best`.
+        Derivations are enumerated without recursion, by backtracking over the alternatives chosen in preorder.
+        Cyclic forests only give the derivations in which no node derives itself, since the others are infinitely many.
+        """
+        if node is None:
+            node = self.root
+
+        if isinstance(node, TerminalNode):
+            yield node
+            return
+
+        cyclic = self.is_cyclic
+        #the nodes of the current derivation in preorder: terminal nodes, and (symbol node, packed node) pairs
+        preorder = []
+        #the alternatives chosen so far: (preorder index, symbol node, packed index, nodes left after its subtree, ancestors)
+        choices = []
+        #linked stacks of (node, ancestors) pairs, shared between choices; ancestors are only kept for cyclic forests
+        pending = ((node, None), None)
+
+        while True:
+            complete = True
+
+            while pending is not None:
+                (cur, ancestors), pending = pending
+
+                if isinstance(cur, TerminalNode):
+                    preorder.append(cur)
+                    continue
+
+                if cyclic and _derives_itself(cur, ancestors):
+                    complete = False
+                    break
+
+                choices.append((len(preorder), cur, 0, pending, ancestors))
+                preorder.append((cur, cur.packed[0]))
+                pending = _push_children(cur.packed[0].children, (cur, ancestors) if cyclic else None, pending)
+
+            if complete:
+                yield _preorder_derivation(preorder)
+
+            #the next alternative of the last node that has one
+            while choices:
+                idx, cur, i, rest, ancestors = choices.pop()
+
+                if i + 1 < len(cur.packed):
+                    del preorder[idx:]
+                    choices.append((idx, cur, i + 1, rest, ancestors))
+                    preorder.append((cur, cur.packed[i + 1]))
+                    pending = _push_children(cur.packed[i + 1].children, (cur, ancestors) if cyclic else None, rest)
+                    break
+            else:
+                return
+
+    def _derivation_weight(self, best, weight, packed, ranks):
+        for child, r in zip(packed.children, ranks):
+            weight *= best[child][r][0]
+
+        return weight
+
+    def prune(self, temp_symbols):
+        """
+        Returns a new forest in which the nodes of temporary symbols are replaced by their children.
+        A temporary node with several alternatives is kept (flagged by `is_temp`),
+        since splicing it into its parents would multiply their alternatives.
+        Multiplicities are carried over: those of spliced alternatives multiply, and those of merged alternatives add up.
+        """
+        order = self._postorder()
+        pruned = {}
+
+        for node in order:
+            if isinstance(node, TerminalNode):
+                pruned[node] = TerminalNode(node.symbol, node.token, node.start, node.end)
+            else:
+                pruned[node] = SymbolNode(node.symbol, node.start, node.end, node.symbol in temp_symbols)
+
+        #children are pruned before their parents, but for those of cycles, which are left as they are
+        for node in order:
+            if isinstance(node, TerminalNode):
+                continue
+
+            new_node = pruned[node]
+            candidates = {}
+
+            for packed in node.packed:
+                children = []
+                multiplicity = packed.multiplicity
+
+                for child in packed.children:
+                    new_child = pruned[child]
+
+                    if new_child.symbol not in temp_symbols:
+                        children.append(new_child)
+                    elif isinstance(new_child, SymbolNode):
+                        if len(new_child.packed) == 1:
+                            children.extend(new_child.packed[0].children)
+                            multiplicity *= new_child.packed[0].multiplicity
+                        else:
+                            children.append(new_child)
+
+                children = tuple(children)
+
+                if (packed.rule, children) in candidates:
+                    candidates[(packed.rule, children)].multiplicity += multiplicity
+                else:
+                    new_node.add_packed(packed.rule, children, multiplicity)
+                    candidates[(packed.rule, children)] = new_node.packed[-1]
+
+        return Forest(pruned[self.root])
+
+    def __repr__(self):
+        return "Forest ({}) ({} nodes)".format(self.root, len(self.nodes))
+
+def _push_children(children, ancestors, pending):
+    for child in reversed(children):
+        pending = ((child, ancestors), pending)
+
+    return pending
+
+def _derives_itself(node, ancestors):
+    while ancestors is not None:
+        if ancestors[0] is node:
+            return True
+
+        ancestors = ancestors[1]
+
+    return False
+
+def _preorder_derivation(preorder):
+    #nested derivation tuples, from the nodes of a derivation in preorder
+    stack = []
+
+    for entry in reversed(preorder):
+        if isinstance(entry, TerminalNode):
+            stack.append(entry)
+            continue
+
+        node, packed = entry
+        children = tuple(stack.pop() for child in packed.children)
+        stack.append((node, packed, children))
+
+    return stack[0]
+
+def fold_derivation(derivation, terminal, nonterminal, temp_symbols=()):
+    """
+    Folds a derivation (see `k_best`) bottom-up, without recursion:
+    terminal nodes give terminal(node), and symbol nodes give nonterminal(node, packed node, values of the children).
+    Nodes of temporary symbols give the values of their children instead, except at the root.
+    """
+    #the value lists of the derivations folded so far
+    results = []
+    stack = [(derivation, False)]
+
+    while stack:
+        cur, expanded = stack.pop()
+
+        if isinstance(cur, TerminalNode):
+            if cur.symbol in temp_symbols and cur is not derivation:
+                results.append([])
+            else:
+                results.append([terminal(cur)])
+
+            continue
+
+        node, packed, children = cur
+
+        if not expanded:
+            stack.append((cur, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+
+        idx = len(results) - len(children)
+        values = [value for child_values in results[idx:] for value in child_values]
+        del results[idx:]
+
+        if node.symbol in temp_symbols and cur is not derivation:
+            results.append(values)
+        else:
+            results.append([nonterminal(node, packed, values)])
+
+    return results[0][0]
@@ -0,0 +1,497 @@
+#encoding: UTF-8
+
+import json, functools
+from pyearley.rule import NonterminalSymbol
+
+# Compiled grammars
+# Rules and all the tables the parser needs are computed once,
+# and can be saved to disk so that other processes load them instead of recompiling.
+
+FORMAT_NAME = "pyearley-grammar"
+#1: the rules and the tables of the parser
+#2: rule weights
+#3: FIRST sets of the symbols and the dotted rules
+#4: the rules of the grammar as written, for the rules rewritten by the optimizer
+FORMAT_VERSION = 4
+
+class CompiledGrammar(object):
+    def __init__(self, rules, temp_symbols=(), rule_weights=None, rule_origins=None):
+        self.rules = [tuple(rule) for rule in rules]
+        self.temp_symbols = set(temp_symbols)
+
+        #Maps the rules rewritten by `optimize_rules` to the rules of the grammar they were written from
+        self.rule_origins = {} if rule_origins is None else dict(rule_origins)
+
+        #Weights of the rules, in the same order; rules weigh 1 unless given otherwise
+        self.rule_weights = [1.0] * len(self.rules) if rule_weights is None else list(rule_weights)
+
+        if len(self.rule_weights) != len(self.rules):
+            raise ValueError("expected {} rule weights, got {}".format(len(self.rules), len(self.rule_weights)))
+
+        #Maps anonymous symbol objects to the names they were given at compile time
+        self._symbol_names = {}
+
+        #Cache dictionary
+        self.rule_dict = {}
+
+        for i, r in enumerate(self.rules):
+            if r[0] not in self.rule_dict:
+                self.rule_dict[r[0]] = []
+
+            self.rule_dict[r[0]].append(i)
+
+        #All symbol set
+        self.vocab = functools.reduce(lambda x, y: x | set(y), self.rules, set())
+
+        #Cache nonterminal symbols
+        self.vocab_nonterminal = set([r[0] for r in self.rules])
+
+        #Cache terminal symbols
+        self.vocab_terminal = self.vocab.difference(self.vocab_nonterminal)
+
+        #Cache nullable nonterminal symbols (symbols that can derive the empty string)
+        self.nullable = _nullable_symbols(self.rules)
+
+        #Cache FIRST sets: the terminal symbols each nonterminal symbol can start with
+        self.first = self._first_sets()
+
+        #Cache prediction closures: the rules predicted, directly or transitively, by each nonterminal symbol
+        #along with the nonterminal symbols predicted on the way
+        self.prediction_closure = {}
+        self.prediction_symbols = {}
+
+        for symbol in sorted(self.vocab_nonterminal):
+            closure = []
+            visited = {symbol}
+            stack = [symbol]
+
+            while stack:
+                for r_idx in self.rule_dict[stack.pop()]:
+                    closure.append(r_idx)
+
+                    #the leftmost symbols get predicted, up to and including the first non-nullable one
+                    for rhs_symbol in self.rules[r_idx][1:]:
+                        if rhs_symbol in self.vocab_nonterminal and rhs_symbol not in visited:
+                            visited.add(rhs_symbol)
+                            stack.append(rhs_symbol)
+
+                        if rhs_symbol not in self.nullable:
+                            break
+
+            self.prediction_closure[symbol] = closure
+            self.prediction_symbols[symbol] = visited
+
+        self._build_tables()
+
+    def _first_sets(self):
+        first = {symbol: set() for symbol in self.vocab_nonterminal}
+
+        changed = True
+        while changed:
+            changed = False
+
+            for rule in self.rules:
+                lhs_first = first[rule[0]]
+                n_first = len(lhs_first)
+
+                #the leftmost symbols contribute, up to and including the first non-nullable one
+                for rhs_symbol in rule[1:]:
+                    if rhs_symbol in self.vocab_terminal:
+                        lhs_first.add(rhs_symbol)
+                        break
+
+                    lhs_first.update(first[rhs_symbol])
+
+                    if rhs_symbol not in self.nullable:
+                        break
+
+                if len(lhs_first) != n_first:
+                    changed = True
+
+        return first
+
+    def _dotted_first(self):
+        #FIRST sets of the symbols right of the dot of every dotted rule, as terminal ids,
+        #or None when they can all derive the empty string (the item can complete without scanning)
+        dotted_first = []
+
+        for r_idx, rule in enumerate(self.rules):
+            suffix_first = None
+            rule_first = []
+
+            for rhs_symbol in reversed(rule[1:]):
+                rule_first.append(suffix_first)
+
+                if rhs_symbol in self.vocab_terminal:
+                    suffix_first = frozenset([self.symbol_ids[rhs_symbol]])
+                elif rhs_symbol in self.nullable and suffix_first is None:
+                    suffix_first = None
+                else:
+                    symbol_first = frozenset(self.symbol_ids[s] for s in self.first[rhs_symbol])
+
+                    if rhs_symbol in self.nullable:
+                        suffix_first = symbol_first | suffix_first
+                    else:
+                        suffix_first = symbol_first
+
+            rule_first.append(suffix_first)
+            dotted_first.extend(reversed(rule_first))
+
+        return dotted_first
+
+    def _build_tables(self):
+        #Integer encoding used in the hot loops
+        #Symbols are mapped to ids, and every dotted rule (rule index, dot index) is numbered consecutively,
+        #so that advancing the dot of an item is an increment.
+        self.symbols = sorted(self.vocab)
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.terminal_ids = {symbol: self.symbol_ids[symbol] for symbol in self.vocab_terminal}
+
+        self.is_terminal = [symbol in self.vocab_terminal for symbol in self.symbols]
+        self.is_nullable = [symbol in self.nullable for symbol in self.symbols]
+
+        self.rule_offsets = []
+        self.dotted_rule = []
+        self.dotted_dot = []
+        self.dotted_lhs = []
+        self.dotted_next = [] #id of the symbol at the right of the dot, or -1 for completed rules
+
+        for r_idx, rule in enumerate(self.rules):
+            self.rule_offsets.append(len(self.dotted_rule))
+            lhs = self.symbol_ids[rule[0]]
+
+            for dot_idx in range(len(rule)):
+                self.dotted_rule.append(r_idx)
+                self.dotted_dot.append(dot_idx)
+                self.dotted_lhs.append(lhs)
+                self.dotted_next.append(self.symbol_ids[rule[dot_idx + 1]] if dot_idx < len(rule) - 1 else -1)
+
+        self.dotted_first = self._dotted_first()
+
+        #Prediction closures as dotted rule ids and symbol ids
+        self.closure = [[] for symbol in self.symbols]
+        self.closure_symbols = [frozenset() for symbol in self.symbols]
+
+        for symbol, closure in self.prediction_closure.items():
+            symbol_id = self.symbol_ids[symbol]
+            self.closure[symbol_id] = [self.rule_offsets[r_idx] for r_idx in closure]
+            self.closure_symbols[symbol_id] = frozenset(self.symbol_ids[s] for s in self.prediction_symbols[symbol])
+
+        self._build_lookahead_tables()
+
+    def _build_lookahead_tables(self):
+        #Prediction closures filtered by the next terminal symbol: the dotted rules that can start with it,
+        #and those that can derive the empty string (kept whatever the next terminal is)
+        self.lookahead_closure = [{} for symbol in self.symbols]
+        self.empty_closure = [[] for symbol in self.symbols]
+
+        for symbol_id, closure in enumerate(self.closure):
+            terminals = set()
+
+            for dotted_rule in closure:
+                if self.dotted_first[dotted_rule] is None:
+                    self.empty_closure[symbol_id].append(dotted_rule)
+                else:
+                    terminals.update(self.dotted_first[dotted_rule])
+
+            for terminal in terminals:
+                self.lookahead_closure[symbol_id][terminal] = [dotted_rule for dotted_rule in closure
+                                                               if self.dotted_first[dotted_rule] is None or terminal in self.dotted_first[dotted_rule]]
+
+    def name_of(self, symbol):
+        """
+        Name of a symbol in this grammar; symbols can be given by name or as `pyearley.rule` symbols
+        """
+        if isinstance(symbol, str):
+            return symbol
+
+        return self._symbol_names.get(symbol, symbol.name)
+
+    def to_dict(self):
+        return {"format": FORMAT_NAME,
+                "version": FORMAT_VERSION,
+                "rules": self.rules,
+                "temp_symbols": sorted(self.temp_symbols),
+                "rule_weights": self.rule_weights,
+                "rule_origins": sorted([rule, origin] for rule, origin in self.rule_origins.items()),
+                "nullable": sorted(self.nullable),
+                "rule_dict": self.rule_dict,
+                "prediction_closure": self.prediction_closure,
+                "prediction_symbols": {k: sorted(v) for k, v in self.prediction_symbols.items()},
+                "symbols": self.symbols,
+                "rule_offsets": self.rule_offsets,
+                "dotted_rule": self.dotted_rule,
+                "dotted_dot": self.dotted_dot,
+                "dotted_lhs": self.dotted_lhs,
+                "dotted_next": self.dotted_next,
+                "first": {k: sorted(v) for k, v in self.first.items()},
+                "dotted_first": [None if f is None else sorted(f) for f in self.dotted_first],
+                "closure": self.closure,
+                "closure_symbols": [sorted(s) for s in self.closure_symbols]}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("format") != FORMAT_NAME:
+            raise ValueError("not a compiled grammar")
+
+        version = data.get("version")
+
+        if version not in range(1, FORMAT_VERSION + 1):
+            raise ValueError("unsupported compiled grammar version: {!r}".format(version))
+
+        #Tables are loaded as they are. Those added by later versions are given their defaults, or computed, for older grammars,
+        #and the lookahead tables, which only derive from the loaded ones, are always computed.
+        grammar = cls.__new__(cls)
+        grammar.rules = [tuple(rule) for rule in data["rules"]]
+        grammar.temp_symbols = set(data["temp_symbols"])
+        grammar.rule_weights = data["rule_weights"] if version >= 2 else [1.0] * len(grammar.rules)
+        grammar.rule_origins = {tuple(rule): tuple(origin) for rule, origin in data["rule_origins"]} if version >= 4 else {}
+        grammar._symbol_names = {}
+
+        grammar.rule_dict = data["rule_dict"]
+        grammar.vocab_nonterminal = set(grammar.rule_dict)
+        grammar.symbols = data["symbols"]
+        grammar.vocab = set(grammar.symbols)
+        grammar.vocab_terminal = grammar.vocab.difference(grammar.vocab_nonterminal)
+        grammar.nullable = set(data["nullable"])
+        grammar.prediction_closure = data["prediction_closure"]
+        grammar.prediction_symbols = {k: set(v) for k, v in data["prediction_symbols"].items()}
+
+        grammar.symbol_ids = {symbol: i for i, symbol in enumerate(grammar.symbols)}
+        grammar.terminal_ids = {symbol: grammar.symbol_ids[symbol] for symbol in grammar.vocab_terminal}
+        grammar.is_terminal = [symbol in grammar.vocab_terminal for symbol in grammar.symbols]
+        grammar.is_nullable = [symbol in grammar.nullable for symbol in grammar.symbols]
+
+        grammar.rule_offsets = data["rule_offsets"]
+        grammar.dotted_rule = data["dotted_rule"]
+        grammar.dotted_dot = data["dotted_dot"]
+        grammar.dotted_lhs = data["dotted_lhs"]
+        grammar.dotted_next = data["dotted_next"]
+
+        if version >= 3:
+            grammar.first = {k: set(v) for k, v in data["first"].items()}
+            grammar.dotted_first = [None if f is None else frozenset(f) for f in data["dotted_first"]]
+        else:
+            grammar.first = grammar._first_sets()
+            grammar.dotted_first = grammar._dotted_first()
+
+        grammar.closure = data["closure"]
+        grammar.closure_symbols = [frozenset(s) for s in data["closure_symbols"]]
+
+        grammar._build_lookahead_tables()
+
+        return grammar
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def __repr__(self):
+        return "CompiledGrammar ({} rules, {} symbols)".format(len(self.rules), len(self.symbols))
+
+def _nullable_symbols(rules):
+    nullable = set()
+
+    changed = True
+    while changed:
+        changed = False
+
+        for rule in rules:
+            if rule[0] not in nullable and all(s in nullable for s in rule[1:]):
+                nullable.add(rule[0])
+                changed = True
+
+    return nullable
+
+def _inline_symbol(rules, weights, origins, symbol, nullable):
+    #Rewrites the rules using the temporary symbol with its alternatives instead, in place.
+    #Returns whether the symbol was inlined.
+    alternatives = [i for i, rule in enumerate(rules) if rule[0] == symbol]
+    users = [i for i, rule in enumerate(rules) if rule[0] != symbol and symbol in rule[1:]]
+
+    if not alternatives or not users:
+        return False
+
+    #recursive symbols cannot be inlined away
+    if any(symbol in rules[i][1:] for i in alternatives):
+        return False
+
+    #several empty alternatives would give different rules for what is the same tree once the symbol is pruned
+    if sum(1 for i in alternatives if all(s in nullable for s in rules[i][1:])) > 1:
+        return False
+
+    #the grammar must not grow: symbols of several alternatives are only inlined into a single occurrence
+    if len(alternatives) > 1 and sum(rules[i][1:].count(symbol) for i in users) > 1:
+        return False
+
+    #a nullable symbol both in the alternatives and around the symbol could match a child at either place,
+    #and these derivations would be packed together once the symbol no longer separates them
+    inlined_nullable = set(s for i in alternatives for s in rules[i][1:] if s in nullable)
+
+    for i in users:
+        around = set(s for s in rules[i][1:] if s != symbol and s in nullable)
+
+        if rules[i][1:].count(symbol) > 1:
+            around.update(inlined_nullable)
+
+        if not around.isdisjoint(inlined_nullable):
+            return False
+
+    new_rules = []
+
+    for i in users:
+        expansions = [((rules[i][0], ), weights[i])]
+
+        for rhs_symbol in rules[i][1:]:
+            if rhs_symbol != symbol:
+                expansions = [(rule + (rhs_symbol, ), w) for rule, w in expansions]
+            else:
+                expansions = [(rule + rules[j][1:], w * weights[j]) for rule, w in expansions for j in alternatives]
+
+        new_rules.extend((rule, w, origins[i]) for rule, w in expansions)
+
+    #two derivations must not end up sharing a rule
+    replaced = set(users) | set(alternatives)
+    kept = set(rule for i, rule in enumerate(rules) if i not in replaced)
+    added = [rule for rule, w, origin in new_rules]
+
+    if len(set(added)) != len(added) or kept.intersection(added):
+        return False
+
+    position = min(users)
+    kept_idx = [i for i in range(len(rules)) if i not in replaced]
+    before = [i for i in kept_idx if i < position]
+    after = [i for i in kept_idx if i > position]
+
+    rules[:], weights[:], origins[:] = (
+        [rules[i] for i in before] + [rule for rule, w, origin in new_rules] + [rules[i] for i in after],
+        [weights[i] for i in before] + [w for rule, w, origin in new_rules] + [weights[i] for i in after],
+        [origins[i] for i in before] + [origin for rule, w, origin in new_rules] + [origins[i] for i in after])
+
+    return True
+
+def optimize_rules(rules, root, temp_symbols, rule_weights=None):
+    """
+    Rewrites the rules so that they are parsed faster, but give the same trees once temporary symbols are pruned.
+    Temporary symbols (chains of anonymous `Or`, `And` and `Forward` symbols, ignored symbols) are inlined
+    into the rules using them, which flattens nested sequences and removes unit rules,
+    and useless symbols (deriving no string, or unreachable from the root symbol) are removed.
+    Rule weights are multiplied along the inlined rules.
+    Returns the rules, their weights and the mapping of the rewritten rules to the rules they were written from.
+    """
+    rules = [tuple(rule) for rule in rules]
+    weights = [1.0] * len(rules) if rule_weights is None else list(rule_weights)
+    origins = list(rules)
+    nullable = _nullable_symbols(rules)
+    nonterminals = set(rule[0] for rule in rules)
+
+    for symbol in sorted(nonterminals.intersection(temp_symbols)):
+        if symbol != root:
+            _inline_symbol(rules, weights, origins, symbol, nullable)
+
+    #Symbols deriving some string of terminal symbols
+    nonterminals = set(rule[0] for rule in rules)
+    productive = set()
+
+    changed = True
+    while changed:
+        changed = False
+
+        for rule in rules:
+            if rule[0] not in productive and all(s in productive or s not in nonterminals for s in rule[1:]):
+                productive.add(rule[0])
+                changed = True
+
+    #Symbols reachable from the root through productive rules
+    kept = [i for i, rule in enumerate(rules) if all(s in productive or s not in nonterminals for s in rule)]
+    reachable = {root}
+    stack = [root]
+
+    while stack:
+        lhs = stack.pop()
+
+        for i in kept:
+            if rules[i][0] == lhs:
+                for rhs_symbol in rules[i][1:]:
+                    if rhs_symbol not in reachable:
+                        reachable.add(rhs_symbol)
+                        stack.append(rhs_symbol)
+
+    kept = [i for i in kept if rules[i][0] in reachable]
+    rule_origins = dict((rules[i], origins[i]) for i in kept if rules[i] != origins[i])
+
+    return [rules[i] for i in kept], [weights[i] for i in kept], rule_origins
+
+def compile_grammar(symbol, optimize=False):
+    """
+    Compiles the grammar reachable from a `pyearley.rule` symbol.
+    Symbols are visited in the order they appear in right hand sides, and anonymous symbols are renamed
+    after that order (SYM_000000, SYM_000001, ...), so that compiling the same grammar always gives the same result.
+    Rules are rewritten by `optimize_rules` if `optimize`.
+    """
+    symbols = []
+    visited = set()
+    stack = [symbol]
+
+    while stack:
+        cur_symbol = stack.pop()
+
+        if cur_symbol in visited:
+            continue
+
+        visited.add(cur_symbol)
+        symbols.append(cur_symbol)
+
+        if isinstance(cur_symbol, NonterminalSymbol):
+            stack.extend(reversed(cur_symbol.rhs))
+
+    named = set(s.name for s in symbols if not s.is_anonymous)
+    renamed = {}
+    symbol_names = {}
+    n_renamed = 0
+
+    for s in symbols:
+        if not s.is_anonymous:
+            continue
+
+        name = None
+
+        while name is None or name in named:
+            name = "SYM_{:06d}".format(n_renamed)
+            n_renamed += 1
+
+        renamed[s.name] = name
+        symbol_names[s] = name
+
+    rules = []
+    visited_rules = set()
+    weights = {}
+
+    for s in symbols:
+        if not isinstance(s, NonterminalSymbol):
+            continue
+
+        for rule in sorted(tuple(renamed.get(name, name) for name in r) for r in s.expand()):
+            if rule not in visited_rules:
+                visited_rules.add(rule)
+                rules.append(rule)
+
+        for r, weight in s.rule_weights().items():
+            weights[tuple(renamed.get(name, name) for name in r)] = weight
+
+    temp_symbols = set(renamed.get(s.name, s.name) for s in symbols if s.is_temp)
+    rule_weights = [weights.get(rule, 1.0) for rule in rules]
+    rule_origins = None
+
+    if optimize:
+        rules, rule_weights, rule_origins = optimize_rules(rules, renamed.get(symbol.name, symbol.name), temp_symbols, rule_weights)
+
+    grammar = CompiledGrammar(rules, temp_symbols, rule_weights, rule_origins)
+    grammar._symbol_names = symbol_names
+
+    return grammar
@@ -0,0 +1,71 @@
+#encoding: UTF-8
+
+# Token lattices
+# A lattice is a DAG over positions 0..n whose arcs carry candidate tokens,
+# so that every tagging of the input can be parsed in a single chart.
+
+#Input elements of these types hold the candidate tokens of a position
+_CANDIDATE_TYPES = (set, frozenset, list, tuple, dict)
+
+def _iter_candidates(element):
+    """
+    Candidate tokens of an input element, as (token, weight) pairs.
+    Dictionaries map candidate tokens to their weights; other candidates weigh nothing in particular (None).
+    """
+    if isinstance(element, dict):
+        return element.items()
+
+    if isinstance(element, _CANDIDATE_TYPES):
+        return ((token, None) for token in element)
+
+    return ((element, None), )
+
+class Lattice(object):
+    def __init__(self, candidates=None):
+        #maps start positions to lists of (token, end position)
+        self._arcs = {}
+        #maps (start, token, end) arcs to their weights, for the arcs that were given one
+        self._weights = {}
+        self.n_positions = 0
+
+        if candidates is not None:
+            for i, element in enumerate(candidates):
+                for token, weight in _iter_candidates(element):
+                    self.add_arc(i, i + 1, token, weight)
+
+            self.n_positions = max(self.n_positions, len(candidates))
+
+    def add_arc(self, start, end, token, weight=None):
+        if not 0 <= start < end:
+            raise ValueError("invalid arc: ({}, {})".format(start, end))
+
+        if start not in self._arcs:
+            self._arcs[start] = []
+
+        if (token, end) not in self._arcs[start]:
+            self._arcs[start].append((token, end))
+
+        if weight is not None:
+            self._weights[(start, token, end)] = weight
+
+        self.n_positions = max(self.n_positions, end)
+
+        return self
+
+    def arcs(self, start=None):
+        """
+        Arcs as (start, token, end) tuples, either all of them or those leaving a position
+        """
+        if start is not None:
+            return [(start, token, end) for token, end in self._arcs.get(start, ())]
+
+        return [(s, token, end) for s in sorted(self._arcs) for token, end in self._arcs[s]]
+
+    def weight(self, start, token, end):
+        return self._weights.get((start, token, end), 1.0)
+
+    def __len__(self):
+        return self.n_positions
+
+    def __repr__(self):
+        return "Lattice ({} positions, {} arcs)".format(self.n_positions, sum(len(a) for a in self._arcs.values()))
@@ -0,0 +1,128 @@
+#encoding: UTF-8
+
+from pyearley.spans import SpanChart
+
+# Partial parses
+# Inputs are parsed once with error recovery: wherever the parse cannot go on, the target symbol is predicted again,
+# so that the chart also holds the constituents after the error.
+# Everything else is read from that chart, without reparsing any part of the input.
+
+class PartialParse(SpanChart):
+    def __init__(self, parser, chart, target_symbol, temp_symbols=()):
+        super(PartialParse, self).__init__(parser, chart, temp_symbols)
+        self.target_symbol = parser.grammar.name_of(target_symbol)
+
+        self._cover = None
+
+    @property
+    def prefix_end(self):
+        """
+        End of the longest prefix of the input derived from the target symbol, or None
+        """
+        spans = self.spans(self.target_symbol)
+
+        for start, end in reversed(spans):
+            if start == 0:
+                return end
+
+        return None
+
+    @property
+    def is_complete(self):
+        return self.prefix_end == self.n_positions
+
+    @property
+    def error(self):
+        """
+        (position, expected terminal symbols) of the first position the parse of the target symbol could not go on from,
+        or None for complete parses. The position is the end of the input when the input ended too early.
+        """
+        if self.is_complete:
+            return None
+
+        if self.chart.failure is not None:
+            return self.chart.failure
+
+        return (self.n_positions, self.parser._expected_terminals(self.chart, self.target_symbol, self.n_positions))
+
+    def prefix_trees(self):
+        """
+        Trees of the longest prefix derived from the target symbol
+        """
+        prefix_end = self.prefix_end
+
+        if prefix_end is None:
+            return []
+
+        return list(self.trees(self.target_symbol, 0, prefix_end))
+
+    def _span_symbol(self, start, end):
+        #the symbol of a span that no other symbol of the same span derives, the target symbol first
+        symbols = self._span_symbols[(start, end)]
+
+        if self.target_symbol in symbols:
+            return self.target_symbol
+
+        derived = set()
+
+        for symbol in symbols:
+            forest = self.forest(symbol, start, end)
+            derived.update(other for other in symbols if other != symbol and forest.get(other, start, end) is not None)
+
+        #symbols deriving one another over the span are all candidates
+        return min(symbols - derived or symbols)
+
+    @property
+    def cover(self):
+        """
+        The fewest constituents covering the input, as (symbol, start, end) triples in input order.
+        Symbols generated by the grammar are left out, and positions no constituent covers are (None, position, position + 1).
+        """
+        if self._cover is not None:
+            return self._cover
+
+        self._index()
+
+        n = self.n_positions
+        starts = [[] for i in range(n + 1)]
+
+        for start, end in self._span_symbols:
+            starts[end].append(start)
+
+        #best[end]: (constituents, uncovered positions, start of the last constituent) of the best cover up to end
+        best = [(0, 0, None)] + [None] * n
+
+        for end in range(1, n + 1):
+            for start in sorted(starts[end]):
+                cost = (best[start][0] + 1, best[start][1])
+
+                if best[end] is None or cost < best[end][:2]:
+                    best[end] = cost + (start, )
+
+            cost = (best[end - 1][0] + 1, best[end - 1][1] + 1)
+
+            if best[end] is None or cost < best[end][:2]:
+                best[end] = cost + (None, )
+
+        cover = []
+        end = n
+
+        while end > 0:
+            start = best[end][2]
+
+            if start is None:
+                cover.append((None, end - 1, end))
+                end -= 1
+            else:
+                cover.append((self._span_symbol(start, end), start, end))
+                end = start
+
+        self._cover = list(reversed(cover))
+
+        return self._cover
+
+    def __repr__(self):
+        if self.is_complete:
+            return "PartialParse (complete)"
+
+        return "PartialParse (error at {}) ({} constituents)".format(self.error[0], len(self.cover))
@@ -25,6 +25,7 @@ def _create_random_name(l=6):
 class Symbol():
     def __init__(self, name=None, is_terminal=False, is_temp=None):
         is_temp = True
+        is_anonymous = name is None
 
         if name is None:
             name = _create_random_name()
@@ -33,6 +34,7 @@ class Symbol():
 
         self.set_name(name)
         self.is_temp = is_temp
+        self.is_anonymous = is_anonymous
 
         if is_temp is not None:
             self.is_temp = is_temp
@@ -40,10 +42,19 @@ class Symbol():
         self.is_terminal = is_terminal
         self.rhs = []
 
+        #weight of the rules this symbol expands to, if any
+        self.weight = None
+
     def set_name(self, name):
         _NAME_HISTORY.add(name)
         self.name = name
         self.is_temp = False
+        self.is_anonymous = False
+
+        return self
+
+    def set_weight(self, weight):
+        self.weight = weight
 
         return self
 
@@ -141,6 +152,15 @@ class NonterminalSymbol(Symbol):
     def expand(self):
         raise NotImplementedError()
 
+    def rule_weights(self):
+        """
+        Maps the rules this symbol expands to onto their weights, for the rules that were given one
+        """
+        if self.weight is None:
+            return {}
+
+        return {rule: self.weight for rule in self.expand()}
+
 class Forward(NonterminalSymbol):
     def __init__(self, *args, **kwargs):
         super(Forward, self).__init__(*args, **kwargs)
@@ -158,11 +178,31 @@ class Or(NonterminalSymbol):
     def __init__(self, *args, **kwargs):
         super(Or, self).__init__(*args, **kwargs)
 
+        #per alternative weights, overriding the weight of the symbol
+        self.rhs_weights = []
+
     def expand(self):
         ruleset = {(self.name, symbol.name) for symbol in self.rhs}
 
         return ruleset
 
+    def set_weights(self, *weights):
+        if len(weights) != len(self.rhs):
+            raise ValueError("expected {} weights, got {}".format(len(self.rhs), len(weights)))
+
+        self.rhs_weights = list(weights)
+
+        return self
+
+    def rule_weights(self):
+        weights = NonterminalSymbol.rule_weights(self)
+
+        for symbol, weight in zip(self.rhs, self.rhs_weights):
+            if weight is not None:
+                weights[(self.name, symbol.name)] = weight
+
+        return weights
+
     def __or__(self, other):
         return self.add_rhs(other)
 
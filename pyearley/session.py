@@ -0,0 +1,116 @@
+#encoding: UTF-8
+
+from pyearley.lattice import _iter_candidates
+
+# Parse sessions
+# Tokens are parsed as they arrive: every token only costs the work of its own state set,
+# and an input that can no longer be derived is noticed at the first token that cannot be scanned.
+# Edited inputs are reparsed from the first edited token on, since the state sets before it do not change.
+
+class ParseSession(object):
+    def __init__(self, parser, target_symbol, temp_symbols=None):
+        self.parser = parser
+        self.target_symbol = target_symbol
+        #symbols pruned from the trees returned by `finish`, if any
+        self.temp_symbols = temp_symbols
+        self.tokens = []
+
+        self.chart = parser._new_chart(target_symbol)
+        parser._close_state_set(self.chart, 0)
+
+    def feed(self, token):
+        """
+        Parses the next token, which can also be a collection of candidate tokens (as in a lattice position).
+        Returns whether the tokens fed so far are still a viable prefix.
+        """
+        cur_state_idx = len(self.tokens)
+        self.tokens.append(token)
+
+        scans = {}
+
+        for candidate, weight in _iter_candidates(token):
+            self.parser._add_scan(scans, candidate, cur_state_idx + 1)
+
+        self.chart.extend(cur_state_idx + 2)
+        self.parser._scan_state_set(self.chart, cur_state_idx, scans)
+
+        #the next token is not known yet, so the state set is closed with predictions
+        if self.chart.state_sets[cur_state_idx + 1]:
+            self.parser._close_state_set(self.chart, cur_state_idx + 1)
+
+        return self.is_viable_prefix()
+
+    def rewind(self, n_tokens):
+        """
+        Drops the tokens after the first `n_tokens`, along with the state sets they produced.
+        The state set at `n_tokens` is kept as it was closed, so the next token is scanned from it right away.
+        """
+        if not 0 <= n_tokens <= len(self.tokens):
+            raise IndexError("cannot rewind {} tokens to {}".format(len(self.tokens), n_tokens))
+
+        del self.tokens[n_tokens:]
+        self.chart.truncate(n_tokens + 1)
+
+    def edit(self, start, end, tokens=()):
+        """
+        Replaces the tokens from `start` to `end` (excluded) by `tokens`, and reparses the input from `start` on.
+        State sets up to `start` only depend on the tokens before it, so they are reused.
+        Returns whether the edited tokens are a viable prefix.
+        """
+        if not 0 <= start <= end <= len(self.tokens):
+            raise IndexError("invalid edit: ({}, {})".format(start, end))
+
+        suffix = self.tokens[end:]
+        self.rewind(start)
+
+        for token in list(tokens) + suffix:
+            self.feed(token)
+
+        return self.is_viable_prefix()
+
+    def replace(self, index, token):
+        return self.edit(index, index + 1, [token])
+
+    def insert(self, index, token):
+        return self.edit(index, index, [token])
+
+    def delete(self, index):
+        return self.edit(index, index + 1)
+
+    def is_viable_prefix(self):
+        """
+        Tells whether some items survived the tokens fed so far, that is, whether they can still be continued
+        """
+        return len(self.chart.state_sets[len(self.tokens)]) > 0
+
+    def expected_terminals(self):
+        """
+        Terminal symbols that can be fed next
+        """
+        grammar = self.parser.grammar
+        waiting = self.chart.waiting[len(self.tokens)]
+
+        return sorted(grammar.symbols[symbol_id] for symbol_id in waiting if grammar.is_terminal[symbol_id])
+
+    def finish(self, target_symbol=None):
+        """
+        Ends the input and returns the parse trees of the tokens fed so far, as `EarleyParser.parse` does.
+        The target symbol defaults to the one the session started with,
+        and can be any symbol predicted from it at the start of the input.
+        """
+        if target_symbol is None:
+            target_symbol = self.target_symbol
+
+        grammar = self.parser.grammar
+        target = grammar.symbol_ids.get(grammar.name_of(target_symbol))
+
+        if target is not None and target not in self.chart.seed_predicted:
+            raise ValueError("{} is not predicted by the session target symbol".format(grammar.name_of(target_symbol)))
+
+        return self.parser._chart_trees(self.chart, target_symbol, self.temp_symbols or ())
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __repr__(self):
+        return "ParseSession ({} tokens, {})".format(len(self.tokens), "viable" if self.is_viable_prefix() else "dead")
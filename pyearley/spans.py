@@ -0,0 +1,108 @@
+#encoding: UTF-8
+
+# Span queries
+# A chart whose symbols were predicted at every position holds the constituents of the whole input and of all its substrings.
+# They are indexed once, and their trees are only built on demand, from the forest of the queried span.
+
+class SpanChart(object):
+    def __init__(self, parser, chart, temp_symbols=()):
+        self.parser = parser
+        self.chart = chart
+        #symbols pruned from the trees
+        self.temp_symbols = temp_symbols
+        self.n_positions = len(chart.state_sets) - 1
+
+        self._symbol_spans = None
+        self._span_symbols = None
+
+    def _index(self):
+        #Indexes the completed constituents by symbol, and by span for the symbols not generated by the grammar.
+        #Empty spans are left out, since empty derivations leave no nodes.
+        if self._symbol_spans is not None:
+            return
+
+        parser = self.parser
+        grammar = parser.grammar
+        chart = self.chart
+        symbol_spans = {}
+        span_symbols = {}
+
+        for state_idx, state_set in enumerate(chart.state_sets):
+            #completed items skipped by Leo's optimization are constituents as well
+            if state_idx in chart.leo_entries:
+                parser._leo_unfold(chart, state_idx)
+
+            for items in (state_set, chart.leo_completed.get(state_idx, ())):
+                for item in items:
+                    dotted_rule = item & parser._item_mask
+                    src_state_idx = item >> parser._item_shift
+
+                    if grammar.dotted_next[dotted_rule] >= 0 or src_state_idx == state_idx:
+                        continue
+
+                    symbol = grammar.symbols[grammar.dotted_lhs[dotted_rule]]
+                    span = (src_state_idx, state_idx)
+
+                    if symbol not in symbol_spans:
+                        symbol_spans[symbol] = set()
+
+                    symbol_spans[symbol].add(span)
+
+                    if symbol in grammar.temp_symbols:
+                        continue
+
+                    if span not in span_symbols:
+                        span_symbols[span] = set()
+
+                    span_symbols[span].add(symbol)
+
+        self._symbol_spans = symbol_spans
+        self._span_symbols = span_symbols
+
+    def spans(self, symbol):
+        """
+        The (start, end) spans of the constituents of the symbol, in input order
+        """
+        self._index()
+
+        return sorted(self._symbol_spans.get(self.parser.grammar.name_of(symbol), ()))
+
+    def symbols(self):
+        """
+        Symbols with at least one constituent
+        """
+        self._index()
+
+        return sorted(self._symbol_spans)
+
+    def forest(self, symbol, start, end):
+        """
+        The parse forest of a constituent, or None
+        """
+        return self.parser._traceback_create_forest(self.chart, self.parser.grammar.name_of(symbol), end, start)
+
+    def trees(self, symbol, start, end):
+        """
+        Yields the trees of a constituent, one at a time
+        """
+        forest = self.forest(symbol, start, end)
+
+        if forest is None:
+            return
+
+        n_trees = 0
+
+        for derivation in forest.derivations():
+            self.chart.check_cancelled()
+
+            if self.chart.budget is not None:
+                self.chart.budget.check_trees(n_trees)
+
+            n_trees += 1
+
+            yield self.parser._derivation_tree(derivation, self.temp_symbols)
+
+    def __repr__(self):
+        self._index()
+
+        return "SpanChart ({} positions) ({} constituents)".format(self.n_positions, sum(len(spans) for spans in self._symbol_spans.values()))
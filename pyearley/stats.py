@@ -0,0 +1,175 @@
+#encoding: UTF-8
+
+import timeit
+
+# Parse statistics
+# Parses given a `ParseStats` object fill it with counts per state set and timings per phase.
+# Counts are taken from the chart once a state set is closed, so the parsing loops are left as they are
+# and parses without statistics pay nothing for them.
+# The recognizer has no chart to take them from: it counts derivations as it goes, and records no back-pointers.
+
+timer = timeit.default_timer
+
+class StateSetStats(object):
+    def __init__(self, index, items, predicted, scanned, completed, skipped, leo, back_pointers, duplicates):
+        self.index = index
+        #items of the closed state set
+        self.items = items
+        #items predicted at this position
+        self.predicted = predicted
+        #derivations of items by scanning a token, by completing a symbol, and by skipping a nullable symbol
+        self.scanned = scanned
+        self.completed = completed
+        self.skipped = skipped
+        #completions that jumped to the top of a deterministic reduction path (Leo)
+        self.leo = leo
+        self.back_pointers = back_pointers
+        #derivations of items that were already in the state set
+        self.duplicates = duplicates
+
+    def as_dict(self):
+        return {"index": self.index,
+                "items": self.items,
+                "predicted": self.predicted,
+                "scanned": self.scanned,
+                "completed": self.completed,
+                "skipped": self.skipped,
+                "leo": self.leo,
+                "back_pointers": self.back_pointers,
+                "duplicates": self.duplicates}
+
+    def __repr__(self):
+        return "StateSetStats ({}) ({} items, {} back-pointers)".format(self.index, self.items, self.back_pointers)
+
+class ParseStats(object):
+    def __init__(self, callback=None):
+        #called with the StateSetStats of every state set as soon as it is closed
+        self.callback = callback
+        self.state_sets = []
+        #seconds spent per phase ("chart", "forest", "trees", "count", "inside", "k_best", "prune"),
+        #summed over the parses recorded
+        self.timings = {}
+        #items per rule, over all state sets
+        self.rule_items = {}
+        self.forest_nodes = 0
+        self.trees = 0
+
+    def _count_items(self, parser, state_set, state_idx):
+        #counts the items of the state set per rule, and returns how many were predicted there
+        mask = parser._item_mask
+        shift = parser._item_shift
+        dotted_rule = parser.grammar.dotted_rule
+        dotted_dot = parser.grammar.dotted_dot
+        rules = parser.rules
+        predicted = 0
+
+        for item in state_set:
+            rule = rules[dotted_rule[item & mask]]
+            self.rule_items[rule] = self.rule_items.get(rule, 0) + 1
+
+            if item >> shift == state_idx and dotted_dot[item & mask] == 0:
+                predicted += 1
+
+        return predicted
+
+    def _record_state_set(self, parser, chart, state_idx):
+        state_set = chart.state_sets[state_idx]
+        traceback = chart.traceback[state_idx]
+        predicted = self._count_items(parser, state_set, state_idx)
+        scanned, completed, skipped = 0, 0, 0
+
+        for derivations in traceback.values():
+            for child, prev in derivations:
+                if child is None:
+                    skipped += 1
+                elif isinstance(child[0], tuple):
+                    scanned += 1
+                else:
+                    completed += 1
+
+        back_pointers = scanned + completed + skipped
+        self._add_state_set(StateSetStats(state_idx, len(state_set), predicted, scanned, completed, skipped,
+                                          len(chart.leo_entries.get(state_idx, ())), back_pointers, back_pointers - len(traceback)))
+
+    def _record_recognized_state_set(self, parser, state_set, state_idx, scanned, completed, skipped, leo):
+        #The recognizer keeps no back-pointers: it counts the derivations of items as it makes them,
+        #and `leo` counts the completions that jumped a Leo path.
+        #Items other than predictions are derived at least once, the derivations beyond that are duplicates.
+        predicted = self._count_items(parser, state_set, state_idx)
+        derivations = scanned + completed + skipped + leo
+
+        self._add_state_set(StateSetStats(state_idx, len(state_set), predicted, scanned, completed, skipped,
+                                          leo, 0, derivations - (len(state_set) - predicted)))
+
+    def _add_state_set(self, state_set_stats):
+        self.state_sets.append(state_set_stats)
+
+        if self.callback is not None:
+            self.callback(state_set_stats)
+
+    def _add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def _total(self, name):
+        return sum(getattr(s, name) for s in self.state_sets)
+
+    @property
+    def items(self):
+        return self._total("items")
+
+    @property
+    def predicted(self):
+        return self._total("predicted")
+
+    @property
+    def scanned(self):
+        return self._total("scanned")
+
+    @property
+    def completed(self):
+        return self._total("completed")
+
+    @property
+    def back_pointers(self):
+        return self._total("back_pointers")
+
+    @property
+    def duplicates(self):
+        return self._total("duplicates")
+
+    def busiest_rules(self, n=10):
+        """
+        The n rules with the most items, as (rule, items) pairs
+        """
+        return sorted(self.rule_items.items(), key=lambda x: (-x[1], x[0]))[:n]
+
+    def busiest_symbols(self, n=10):
+        """
+        The n left hand side symbols with the most items, as (symbol, items) pairs
+        """
+        symbol_items = {}
+
+        for rule, n_items in self.rule_items.items():
+            symbol_items[rule[0]] = symbol_items.get(rule[0], 0) + n_items
+
+        return sorted(symbol_items.items(), key=lambda x: (-x[1], x[0]))[:n]
+
+    def as_dict(self):
+        """
+        The statistics as plain dictionaries and lists, for serialization
+        """
+        return {"items": self.items,
+                "predicted": self.predicted,
+                "scanned": self.scanned,
+                "completed": self.completed,
+                "back_pointers": self.back_pointers,
+                "duplicates": self.duplicates,
+                "forest_nodes": self.forest_nodes,
+                "trees": self.trees,
+                "timings": dict(self.timings),
+                "state_sets": [s.as_dict() for s in self.state_sets],
+                "busiest_rules": [[list(rule), n_items] for rule, n_items in self.busiest_rules()],
+                "busiest_symbols": [[symbol, n_items] for symbol, n_items in self.busiest_symbols()]}
+
+    def __repr__(self):
+        return "ParseStats ({} state sets, {} items, {} back-pointers)".format(len(self.state_sets), self.items, self.back_pointers)
@@ -1,40 +1,142 @@
-from ete3 import Tree, TreeNode
 from pyearley.rule import Symbol
 
-class InternalNode(object):
-    def __init__(self, rule, children):
-        self.rule = rule
-        self.symbol = rule[0]
-        self.rhs = rule[1:]
-        self.children = list(set(children))
-        self.children_hash = [hash(child) for child in self.children]
-        self.children, self.children_hash = zip(*sorted(zip(self.children, self.children_hash), key=lambda x: x[1]))
-
-    def __hash__(self):
-        return sum(self.children_hash) * 0x774 + hash(self.rule)
-
-    def __eq__(self, other):
-        if isinstance(other, InternalNode):
-            return self.rule == other.rule and len(self.children) == len(other.children) and all(map(lambda x: x[0] == x[1], zip(self.children, other.children)))
-        else:
-            return False
+# Parse trees
+# Parses are returned as `ParseNode` trees, whose nodes span the input from `start` to `end`.
+# ete3 trees are only built on demand (`ParseNode.to_ete3`), since ete3 is a heavy import.
 
-    def __repr__(self):
-        return "InternalNode ({} -> {}) ({} children)".format(self.symbol, self.rhs, len(self.children))
+class ParseNode(object):
+    __slots__ = ("name", "rule", "children", "start", "end", "token", "up")
 
-class LeafNode(object):
-    def __init__(self, literal, token):
-        self.literal = literal
+    def __init__(self, name, start, end, rule=None, children=(), token=None):
+        self.name = name
+        self.rule = rule
+        self.children = list(children)
+        self.start = start
+        self.end = end
+        #the scanned token, for leaves
         self.token = token
+        self.up = None
+
+        for child in self.children:
+            child.up = self
+
+    @property
+    def span(self):
+        return (self.start, self.end)
+
+    @property
+    def tokens(self):
+        """
+        Tokens of the leaves under the node, computed on demand
+        """
+        return [leaf.token for leaf in self.iter_leaves()]
+
+    def is_leaf(self):
+        return self.rule is None
+
+    def is_root(self):
+        return self.up is None
+
+    def get_children(self):
+        return list(self.children)
+
+    def traverse(self):
+        #preorder
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def iter_leaves(self):
+        for node in self.traverse():
+            if node.is_leaf():
+                yield node
+
+    def prune(self, temp_symbols):
+        """
+        Replaces the nodes of temporary symbols under this node by their children, in place and in order
+        """
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+            children = []
+
+            for child in node.children:
+                if child.name in temp_symbols:
+                    #spliced children may be temporary too
+                    pending = list(reversed(child.children))
+
+                    while pending:
+                        grandchild = pending.pop()
+
+                        if grandchild.name in temp_symbols:
+                            pending.extend(reversed(grandchild.children))
+                        else:
+                            children.append(grandchild)
+                else:
+                    children.append(child)
+
+            for child in children:
+                child.up = node
+
+            node.children = children
+            stack.extend(children)
 
-    def __hash__(self):
-        return hash(self.literal) * 0x3523 + hash(self.token)
+        return self
 
-    def __eq__(self, other):
-        return isinstance(other, LeafNode) and self.literal, self.token == other.literal, other.token
+    def to_ete3(self):
+        """
+        Converts the tree to an ete3 tree, with the `rule`, `tokens`, `start` and `end` features
+        """
+        from ete3 import Tree
+
+        root = Tree()
+        stack = [(self, root)]
+
+        while stack:
+            node, tree_node = stack.pop()
+            tree_node.name = node.name
+            tree_node.add_feature("tokens", node.tokens)
+            tree_node.add_feature("start", node.start)
+            tree_node.add_feature("end", node.end)
+
+            if node.rule is not None:
+                tree_node.add_feature("rule", node.rule)
+
+            #children are added in order, and filled in later
+            stack.extend(reversed([(child, tree_node.add_child()) for child in node.children]))
+
+        return root
+
+    def __str__(self):
+        #the strings of the subtrees done so far, built without recursion since trees can be as deep as the input is long
+        parts = []
+        stack = [(self, False)]
+
+        while stack:
+            node, expanded = stack.pop()
+
+            if node.is_leaf():
+                parts.append("({} {})".format(node.name, node.token))
+                continue
+
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
+                continue
+
+            idx = len(parts) - len(node.children)
+            part = "({} {})".format(node.name, " ".join(parts[idx:]))
+            del parts[idx:]
+            parts.append(part)
+
+        return parts[0]
 
     def __repr__(self):
-        return "LeafNode ({}: {})".format(self.literal, self.token)
+        return "ParseNode ({}) [{}, {})".format(self.name, self.start, self.end)
 
 def search(tree, name=None, func=None, **kwargs):
     for node in tree.traverse():
@@ -52,7 +154,7 @@ def search(tree, name=None, func=None, **kwargs):
         if ret:
             yield node
 
-def prune(tree, symbol):
+def prune(tree, symbol, temp_symbols=None):
     def _preprocess(nodes):
         for node in nodes:
             if issubclass(node.__class__, Symbol):
@@ -75,7 +177,13 @@ def prune(tree, symbol):
 
         return True
 
-    temp_symbols = symbol.get_temp_symbols()
+    if temp_symbols is None:
+        temp_symbols = symbol.get_temp_symbols()
+
+    if isinstance(tree, ParseNode):
+        tree.prune(temp_symbols)
+        return
+
     temp_nodes = search(tree, func=lambda x: x.name in temp_symbols)
 
     for temp_node in temp_nodes:
@@ -88,40 +196,3 @@ def prune(tree, symbol):
     #        nodes.append(t_node)
     #
     # return tree.prune(nodes, preserve_branch_length)
-
-class GraphBuilder(object):
-    def __init__(self):
-        pass
-
-    def build(self, parse_node):
-        def _build(parse_node, tree_node=None):
-            if tree_node is None:
-                tree_node = TreeNode()
-
-            if isinstance(parse_node, list):
-                print(parse_node)
-
-            if isinstance(parse_node, LeafNode):
-                symbol = parse_node.literal
-                token = parse_node.token
-
-                tree_node.name = symbol
-                tree_node.add_feature("tokens", [token])
-            elif isinstance(parse_node, InternalNode):
-                symbol = parse_node.symbol
-                rule = parse_node.rule
-                children = parse_node.children
-                token = []
-
-                for child_node in children:
-                    node = _build(child_node)
-                    tree_node.add_child(node)
-                    token.extend(node.tokens)
-
-                tree_node.name = symbol
-                tree_node.add_feature("rule", rule)
-                tree_node.add_feature("tokens", token)
-
-            return tree_node
-
-        return _build(parse_node, Tree())
@@ -86,7 +86,7 @@ def main():
 
     for tree in trees:
         print(tree)
-        tree.show()
+        tree.to_ete3().show()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,332 @@
+#encoding: UTF-8
+
+import gc, time, tracemalloc, itertools, multiprocessing
+from pyearley_test import ruleset1, ruleset2, ruleset3, ruleset4
+from pyearley.rule import Literal, Forward, plus
+from pyearley.earley import EarleyParser as PureEarleyParser
+from pyearley.batch import parse_many
+from pyearley.grammar import compile_grammar
+from pyearley.tree import prune
+
+def sentence(n_clauses):
+    """
+    A ruleset4 sentence made of `n_clauses` connected clauses
+    """
+    return ["N", "JKS", "VV", "EC"] * (n_clauses - 1) + ["N", "JKS", "VA", "ETD", "N", "JKO", "VV", "EP", "EF", "SF"]
+
+def tagged_sentence(n_clauses):
+    """
+    A ruleset4 sentence whose verbs could also be tagged as adjectives, and vice versa
+    """
+    return [{"VV", "VA"} if tag in ("VV", "VA") else tag for tag in sentence(n_clauses)]
+
+def completer_visits(parser, state_sets, waiting):
+    """
+    Counts the items visited by the completer,
+    both by scanning whole state sets (before) and through the per-symbol index (after).
+    """
+    before, after = 0, 0
+
+    for cur_state_idx, state_set in enumerate(state_sets):
+        for item in state_set:
+            item = parser.decode(item)
+            rule = parser.rules[item.rule_idx]
+
+            if item.dot_idx >= len(rule) - 1 and item.src_idx != cur_state_idx:
+                before += len(state_sets[item.src_idx])
+                after += len(waiting[item.src_idx].get(parser.grammar.symbol_ids[rule[0]], ()))
+
+    return before, after
+
+def chart_memory(parser, tokens, target_symbol):
+    """
+    Peak memory (in bytes) allocated while building the chart, back-pointers included
+    """
+    tracemalloc.start()
+    chart = parser._build_chart(tokens, target_symbol)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return peak, sum(len(s) for s in chart.state_sets)
+
+def tree_memory(build):
+    """
+    Seconds and peak memory (in bytes) taken to build the trees returned by `build`
+    """
+    tracemalloc.start()
+    start = time.time()
+    trees = build()
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return trees, elapsed, peak
+
+def main():
+    sent = ruleset4()
+    parser = PureEarleyParser(sent.get_expanded_ruleset())
+
+    print("{:>8} {:>8} {:>12} {:>14} {:>14} {:>10} {:>10}".format("tokens", "set 0", "chart items", "visits before", "visits after", "chart secs", "recog secs"))
+
+    for n_clauses in [1, 2, 4, 8, 16]:
+        tokens = sentence(n_clauses)
+
+        start = time.time()
+        chart = parser._build_chart(tokens, sent)
+        elapsed = time.time() - start
+
+        start = time.time()
+        parser.recognize(tokens, sent)
+        recognize_elapsed = time.time() - start
+
+        before, after = completer_visits(parser, chart.state_sets, chart.waiting)
+        n_items = sum(len(s) for s in chart.state_sets)
+
+        print("{:>8} {:>8} {:>12} {:>14} {:>14} {:>10.4f} {:>10.4f}".format(len(tokens), len(chart.state_sets[0]), n_items, before, after, elapsed, recognize_elapsed))
+
+    #Lookahead: predictions filtered by the FIRST sets of the rules, against predicting every rule
+    grammars = [("ruleset1", ruleset1()[0], ["Y"] + ["X", "Z"] * 20 + ["X"]),
+                ("ruleset2", ruleset2(), ["X", "Y"]),
+                ("ruleset3", ruleset3(), ["X"] + ["Y", "X"] * 20),
+                ("ruleset4", sent, sentence(32)),
+                ("ruleset4 tags", sent, tagged_sentence(32))]
+
+    print("")
+    print("{:>14} {:>8} {:>12} {:>12} {:>10} {:>10} {:>10}".format("grammar", "tokens", "items", "lookahead", "avoided", "secs", "lookahead"))
+
+    for name, symbol, tokens in grammars:
+        rules = symbol.get_expanded_ruleset()
+        n_items, elapsed = [], []
+
+        for lookahead in [False, True]:
+            lookahead_parser = PureEarleyParser(rules, lookahead)
+
+            start = time.time()
+            chart = lookahead_parser._build_chart(tokens, symbol)
+            elapsed.append(time.time() - start)
+            n_items.append(sum(len(s) for s in chart.state_sets))
+
+        print("{:>14} {:>8} {:>12} {:>12} {:>9.1f}% {:>10.4f} {:>10.4f}".format(name, len(tokens), n_items[0], n_items[1], 100.0 * (n_items[0] - n_items[1]) / n_items[0], elapsed[0], elapsed[1]))
+
+    #Grammar optimization: temporary symbols inlined and useless symbols removed
+    print("")
+    print("{:>14} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format("grammar", "rules", "optimized", "items", "optimized", "secs", "optimized", "trees"))
+
+    for name, symbol, tokens in grammars:
+        n_rules, n_items, elapsed, n_trees = [], [], [], []
+
+        for optimize in [False, True]:
+            grammar = compile_grammar(symbol, optimize)
+            optimized_parser = PureEarleyParser(grammar)
+
+            start = time.time()
+            chart = optimized_parser._build_chart(tokens, symbol)
+            elapsed.append(time.time() - start)
+
+            n_rules.append(len(grammar.rules))
+            n_items.append(sum(len(s) for s in chart.state_sets))
+            n_trees.append(optimized_parser.count_parses(tokens, symbol))
+
+        print("{:>14} {:>8} {:>10} {:>10} {:>10} {:>10.4f} {:>10.4f} {:>10}".format(name, n_rules[0], n_rules[1], n_items[0], n_items[1], elapsed[0], elapsed[1],
+                                                                                 "same" if n_trees[0] == n_trees[1] else "differ"))
+
+    print("")
+    print("{:>8} {:>12} {:>12} {:>14}".format("tokens", "chart items", "peak KiB", "bytes per item"))
+
+    for n_clauses in [16, 32, 64]:
+        tokens = sentence(n_clauses)
+        peak, n_items = chart_memory(parser, tokens, sent)
+
+        print("{:>8} {:>12} {:>12} {:>14.1f}".format(len(tokens), n_items, peak // 1024, float(peak) / n_items))
+
+    #Right recursion: the chart, and the parse forest built from it, should grow linearly with the input
+    seq = plus(Literal("a")).set_name("SEQ")
+    parser = PureEarleyParser(seq.get_expanded_ruleset())
+
+    print("")
+    print("{:>8} {:>12} {:>14} {:>10} {:>10} {:>12} {:>10}".format("tokens", "chart items", "items per token", "chart secs", "recog secs", "forest secs", "count secs"))
+
+    for n_tokens in [250, 500, 1000, 2000, 4000]:
+        tokens = ["a"] * n_tokens
+
+        start = time.time()
+        chart = parser._build_chart(tokens, seq)
+        elapsed = time.time() - start
+
+        start = time.time()
+        parser.recognize(tokens, seq)
+        recognize_elapsed = time.time() - start
+
+        start = time.time()
+        parser.parse_forest(tokens, seq)
+        forest_elapsed = time.time() - start
+
+        start = time.time()
+        parser.count_parses(tokens, seq)
+        count_elapsed = time.time() - start
+
+        n_items = sum(len(s) for s in chart.state_sets)
+
+        print("{:>8} {:>12} {:>14.2f} {:>10.4f} {:>10.4f} {:>12.4f} {:>10.4f}".format(n_tokens, n_items, float(n_items) / n_tokens, elapsed, recognize_elapsed,
+                                                                           forest_elapsed, count_elapsed))
+
+    #Streaming: feeding a token only processes its own state set, so the cost per token stays flat
+    print("")
+    print("{:>8} {:>14} {:>14}".format("tokens", "feed secs", "usecs per token"))
+
+    for n_tokens in [1000, 2000, 4000]:
+        session = parser.session(seq)
+
+        start = time.time()
+        for i in range(n_tokens):
+            session.feed("a")
+        elapsed = time.time() - start
+
+        print("{:>8} {:>14.4f} {:>14.1f}".format(n_tokens, elapsed, elapsed * 1e6 / n_tokens))
+
+    #Edits: only the state sets from the edited token on are reparsed
+    sent_parser = PureEarleyParser(sent.get_expanded_ruleset())
+    tokens = sentence(16)
+    session = sent_parser.session(sent)
+
+    for token in tokens:
+        session.feed(token)
+
+    print("")
+    print("{:>8} {:>12} {:>12}".format("tokens", "edit index", "edit secs"))
+
+    for idx in [0, len(tokens) // 2, len(tokens) - 3]:
+        start = time.time()
+        session.replace(idx, tokens[idx])
+        elapsed = time.time() - start
+
+        print("{:>8} {:>12} {:>12.4f}".format(len(tokens), idx, elapsed))
+
+    #Lattice input: one chart for all the taggings, against one chart per tagging
+    parser = PureEarleyParser(sent.get_expanded_ruleset())
+
+    print("")
+    print("{:>8} {:>10} {:>10} {:>14} {:>14}".format("tokens", "taggings", "parses", "lattice secs", "per tag secs"))
+
+    for n_clauses in [1, 2, 3, 4]:
+        lattice = tagged_sentence(n_clauses)
+        taggings = list(itertools.product(*[sorted(c) if isinstance(c, set) else [c] for c in lattice]))
+
+        start = time.time()
+        n_parses = parser.count_parses(lattice, sent)
+        elapsed = time.time() - start
+
+        start = time.time()
+        for tokens in taggings:
+            parser.count_parses(list(tokens), sent)
+        per_tag_elapsed = time.time() - start
+
+        print("{:>8} {:>10} {:>10} {:>14.4f} {:>14.4f}".format(len(lattice), len(taggings), n_parses, elapsed, per_tag_elapsed))
+
+    #Batch parsing: throughput over worker processes
+    corpus = [sentence(1 + i % 4) for i in range(400)]
+
+    print("")
+    print("{:>8} {:>10} {:>14}".format("workers", "secs", "sentences/sec"))
+
+    for workers in sorted(set([1, 2, multiprocessing.cpu_count()])):
+        start = time.time()
+        for result in parse_many(sent_parser.grammar, corpus, sent, workers=workers, chunksize=16, mode="count"):
+            pass
+        elapsed = time.time() - start
+
+        print("{:>8} {:>10.4f} {:>14.1f}".format(workers, elapsed, len(corpus) / elapsed))
+
+    #Trees: native parse trees, against converting them to ete3 trees
+    amb = Forward("S")
+    amb << ((amb + amb) | Literal("a"))
+    amb_parser = PureEarleyParser(amb.get_expanded_ruleset())
+
+    try:
+        import ete3
+    except ImportError:
+        ete3 = None
+
+    print("")
+    print("{:>8} {:>8} {:>12} {:>12} {:>12} {:>12}".format("tokens", "trees", "native secs", "native KiB", "ete3 secs", "ete3 KiB"))
+
+    for n_tokens in [6, 8, 9]:
+        tokens = ["a"] * n_tokens
+        trees, elapsed, peak = tree_memory(lambda: amb_parser.parse(tokens, amb))
+
+        if ete3 is None:
+            ete3_elapsed, ete3_peak = float("nan"), 0
+        else:
+            ete3_trees, ete3_elapsed, ete3_peak = tree_memory(lambda: [tree.to_ete3() for tree in trees])
+
+        print("{:>8} {:>8} {:>12.4f} {:>12} {:>12.4f} {:>12}".format(len(tokens), len(trees), elapsed, peak // 1024, ete3_elapsed, ete3_peak // 1024))
+
+    #Temporary symbols: dropped while the trees are built, against pruning the built trees
+    temp_parser = PureEarleyParser(compile_grammar(sent))
+
+    print("")
+    print("{:>8} {:>8} {:>10} {:>14} {:>14}".format("tokens", "trees", "nodes", "build secs", "prune secs"))
+
+    for n_clauses in [2, 4, 8]:
+        tokens = tagged_sentence(n_clauses)
+        temp_parser.parse(tokens, sent)
+
+        start = time.time()
+        trees = temp_parser.parse(tokens, sent, prune_temp=True)
+        elapsed = time.time() - start
+        n_nodes = sum(1 for tree in trees for node in tree.traverse())
+
+        start = time.time()
+        for tree in temp_parser.parse(tokens, sent):
+            prune(tree, sent, temp_parser.grammar.temp_symbols)
+        prune_elapsed = time.time() - start
+
+        print("{:>8} {:>8} {:>10} {:>14.4f} {:>14.4f}".format(len(tokens), len(trees), n_nodes, elapsed, prune_elapsed))
+
+    #Partial parses: one parse with error recovery, against recognizing every substring of a sentence with an unknown token
+    print("")
+    print("{:>8} {:>8} {:>14} {:>12} {:>14}".format("tokens", "cover", "partial secs", "substrings", "substring secs"))
+
+    for n_clauses in [2, 4, 8]:
+        tokens = sentence(n_clauses)
+        tokens[len(tokens) // 2] = "UNKNOWN"
+        temp_parser.parse_partial(tokens, sent).cover
+        #the trees of the tables above are still alive: a full collection would land in the timings
+        gc.collect()
+
+        start = time.time()
+        partial = temp_parser.parse_partial(tokens, sent)
+        cover = partial.cover
+        elapsed = time.time() - start
+
+        start = time.time()
+        spans = [(i, j) for i in range(len(tokens)) for j in range(i + 1, len(tokens) + 1)]
+        for i, j in spans:
+            temp_parser.recognize(tokens[i:j], sent)
+        substring_elapsed = time.time() - start
+
+        print("{:>8} {:>8} {:>14.4f} {:>12} {:>14.4f}".format(len(tokens), len(cover), elapsed, len(spans), substring_elapsed))
+
+    #Span queries: all the noun phrases from a single chart, against recognizing every substring as one
+    print("")
+    print("{:>8} {:>8} {:>12} {:>12} {:>14}".format("tokens", "NP spans", "spans secs", "substrings", "substring secs"))
+
+    for n_clauses in [2, 4, 8]:
+        tokens = sentence(n_clauses)
+        temp_parser.parse_spans(tokens).spans("NP")
+        gc.collect()
+
+        start = time.time()
+        np_spans = temp_parser.parse_spans(tokens).spans("NP")
+        elapsed = time.time() - start
+
+        start = time.time()
+        spans = [(i, j) for i in range(len(tokens)) for j in range(i + 1, len(tokens) + 1)]
+        for i, j in spans:
+            temp_parser.recognize(tokens[i:j], "NP")
+        substring_elapsed = time.time() - start
+
+        print("{:>8} {:>8} {:>12.4f} {:>12} {:>14.4f}".format(len(tokens), len(np_spans), elapsed, len(spans), substring_elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#encoding: UTF-8
+
+import itertools
+
+# Differential checks
+# Helpers shared by the checks comparing results over many small random grammars and every short input.
+# The same random generator always gives the same grammar, so that failures can be replayed from their seed.
+
+def random_rules(rnd, nonterminals, terminals, start_rule, min_rules, max_rules):
+    """
+    The start rule followed by min_rules to max_rules random rules over the symbols, of up to 3 symbols each,
+    empty, duplicate and cyclic rules included.
+    Nonterminal symbols left without a rule get one to a random terminal symbol.
+    """
+    rules = [start_rule]
+
+    for i in range(rnd.randint(min_rules, max_rules)):
+        rules.append((rnd.choice(nonterminals), ) + tuple(rnd.choice(nonterminals + terminals) for j in range(rnd.randint(0, 3))))
+
+    for symbol in nonterminals:
+        if not any(rule[0] == symbol for rule in rules):
+            rules.append((symbol, rnd.choice(terminals)))
+
+    return rules
+
+def all_inputs(terminals, min_length, max_length):
+    """
+    Every token list over the terminals, shortest first
+    """
+    for length in range(min_length, max_length + 1):
+        for tokens in itertools.product(terminals, repeat=length):
+            yield list(tokens)
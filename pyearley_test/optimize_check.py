@@ -0,0 +1,121 @@
+#encoding: UTF-8
+
+import argparse, collections, random, sys
+from pyearley_test import ruleset1, ruleset2, ruleset3, ruleset4
+from pyearley_test.benchmark import sentence, tagged_sentence
+from pyearley_test.differential import random_rules, all_inputs
+from pyearley.earley import EarleyParser
+from pyearley.grammar import CompiledGrammar, compile_grammar, optimize_rules
+
+# Differential check of the grammar optimizer
+# Every input is parsed with a grammar and with its optimized (and saved, then loaded) version,
+# and the results are compared: recognition, the pruned trees with their rules as written,
+# the inside probability and the weights of the best parses.
+#
+#   python -m pyearley_test.optimize_check --seeds 1500
+
+NONTERMINALS = ["S", "A", "B", "T1", "T2", "T3"]
+TERMINALS = ["a", "b", "c"]
+TEMP_SYMBOLS = {"T1", "T2", "T3"}
+
+def random_grammar(rnd):
+    """
+    (rules, weights) of a few random rules, whose weights sum to 0.9 per left hand side symbol,
+    so that the weights of the empty derivations always converge
+    """
+    rules = sorted(set(random_rules(rnd, NONTERMINALS, TERMINALS, ("S", "T1"), 4, 12)))
+    weights = [rnd.choice([0.25, 0.5, 0.8, 1.0]) for rule in rules]
+    totals = collections.Counter()
+
+    for rule, weight in zip(rules, weights):
+        totals[rule[0]] += weight
+
+    return rules, [0.9 * weight / totals[rule[0]] for rule, weight in zip(rules, weights)]
+
+def _tree_signature(tree):
+    return (tree.name, tree.rule, tree.start, tree.end, tree.token, tuple(_tree_signature(child) for child in tree.children))
+
+def parse_results(parser, tokens, target_symbol):
+    """
+    Results of parsing the tokens to compare, or None for cyclic forests.
+    Cyclic forests are skipped: their trees are only enumerated up to cycles, which the optimizer may remove,
+    and they have no inside probability.
+    """
+    forest = parser.parse_forest(tokens, target_symbol)
+
+    if forest is not None and forest.is_cyclic:
+        return None
+
+    trees = collections.Counter(_tree_signature(tree) for tree in parser.parse(tokens, target_symbol, prune_temp=True))
+
+    return (parser.recognize(tokens, target_symbol), trees, parser.inside_probability(tokens, target_symbol),
+            [weight for tree, weight in parser.k_best_parses(tokens, target_symbol, 3)])
+
+def _same_weight(a, b):
+    return abs(a - b) <= 1e-9 * max(1.0, abs(a), abs(b))
+
+def compare(parsers, tokens, target_symbol):
+    """
+    Whether both parsers give the same results, or None when either forest is cyclic
+    """
+    a, b = [parse_results(parser, tokens, target_symbol) for parser in parsers]
+
+    if a is None or b is None:
+        return None if parsers[0].recognize(tokens, target_symbol) == parsers[1].recognize(tokens, target_symbol) else False
+
+    return a[:2] == b[:2] and _same_weight(a[2], b[2]) and len(a[3]) == len(b[3]) and all(_same_weight(x, y) for x, y in zip(a[3], b[3]))
+
+def run_check(seeds=1500, max_length=3, out=sys.stdout):
+    """
+    Checks the grammars of the given number of random seeds, and the grammars of pyearley_test.
+    Returns the number of inputs with mismatches.
+    """
+    counts = collections.Counter()
+
+    for seed in range(seeds):
+        rules, weights = random_grammar(random.Random(seed))
+        optimized_rules, optimized_weights, origins = optimize_rules(rules, "S", TEMP_SYMBOLS, weights)
+        grammar = CompiledGrammar(rules, TEMP_SYMBOLS, weights)
+        optimized = CompiledGrammar.from_dict(CompiledGrammar(optimized_rules, TEMP_SYMBOLS, optimized_weights, origins).to_dict())
+        parsers = [EarleyParser(grammar), EarleyParser(optimized)]
+        counts["rules"] += len(rules)
+        counts["optimized rules"] += len(optimized_rules)
+
+        for tokens in all_inputs(TERMINALS, 0, max_length):
+            same = compare(parsers, tokens, "S")
+            counts["inputs"] += 1
+
+            if same is None:
+                counts["cyclic"] += 1
+            elif not same:
+                counts["failed"] += 1
+                print("seed {} {} -> {} {}".format(seed, rules, optimized_rules, tokens), file=out)
+
+    for name, symbol, inputs in [("ruleset1", ruleset1()[0], [["Y", "X", "Z", "X"]]),
+                                 ("ruleset2", ruleset2(), [["X", "Y"], ["X"]]),
+                                 ("ruleset3", ruleset3(), [["X", "Y", "X", "Y", "X"]]),
+                                 ("ruleset4", ruleset4(), [sentence(2), tagged_sentence(2), sentence(1)])]:
+        parsers = [EarleyParser(compile_grammar(symbol)), EarleyParser(compile_grammar(symbol, optimize=True))]
+
+        for tokens in inputs:
+            counts["inputs"] += 1
+
+            if not compare(parsers, tokens, symbol):
+                counts["failed"] += 1
+                print("{} {}".format(name, tokens), file=out)
+
+    print("{} of {} inputs failed, {} cyclic ones only recognized; {} rules optimized to {}".format(
+        counts["failed"], counts["inputs"], counts["cyclic"], counts["rules"], counts["optimized rules"]), file=out)
+
+    return counts["failed"]
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="pyearley grammar optimizer check")
+    arg_parser.add_argument("--seeds", type=int, default=1500, help="number of random grammars")
+    arg_parser.add_argument("--max-length", type=int, default=3, help="longest input")
+    args = arg_parser.parse_args(argv)
+
+    return 1 if run_check(args.seeds, args.max_length) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#encoding: UTF-8
+
+import argparse, random, sys
+from pyearley.earley import EarleyParser
+from pyearley.grammar import CompiledGrammar
+from pyearley_test.differential import random_rules, all_inputs
+
+# Differential check of span queries
+# Random grammars parse every input up to a given length once with `parse_spans`,
+# and the spans found are checked against recognizing every substring on its own, as a brute force would.
+# The trees of short spans are checked against parsing the substring as well.
+#
+#   python -m pyearley_test.spans_check --seeds 300
+
+NONTERMINALS = ["S", "A", "B", "C"]
+TERMINALS = ["a", "b", "c"]
+#tokens no rule derives
+UNKNOWN = "z"
+
+def random_grammar(rnd):
+    """
+    A few random rules over NONTERMINALS and TERMINALS, empty and cyclic rules included
+    """
+    return random_rules(rnd, NONTERMINALS, TERMINALS, ("S", "A"), 3, 9)
+
+def check_input(parsers, tokens, max_tree_length):
+    """
+    Returns the (symbol, description) pairs of the mismatches found over the tokens
+    """
+    parser = parsers[0]
+    charts = [p.parse_spans(tokens) for p in parsers]
+    n = len(tokens)
+    mismatches = []
+
+    for symbol in NONTERMINALS:
+        expected = [(i, j) for i in range(n) for j in range(i + 1, n + 1) if parser.recognize(tokens[i:j], symbol)]
+
+        for chart in charts:
+            if chart.spans(symbol) != expected:
+                mismatches.append((symbol, "spans {} instead of {}".format(chart.spans(symbol), expected)))
+
+        if n > max_tree_length:
+            continue
+
+        for i, j in expected:
+            trees = sorted(str(tree) for tree in charts[0].trees(symbol, i, j))
+
+            if trees != sorted(str(tree) for tree in parser.parse(tokens[i:j], symbol)):
+                mismatches.append((symbol, "trees of [{}, {})".format(i, j)))
+
+            if next(charts[0].trees(symbol, i, j)).span != (i, j):
+                mismatches.append((symbol, "tree span of [{}, {})".format(i, j)))
+
+    #seeding a single symbol finds at least all of its own spans
+    if parser.parse_spans(tokens, "S").spans("S") != charts[0].spans("S"):
+        mismatches.append(("S", "spans of a single seed"))
+
+    return mismatches
+
+def run_check(seeds=300, max_length=5, max_tree_length=3, out=sys.stdout):
+    """
+    Checks the grammars of the given number of random seeds, with and without lookahead.
+    Cyclic grammars are checked too: trees are enumerated without repeating a node under itself on both sides.
+    Returns the number of inputs with mismatches.
+    """
+    n_inputs = 0
+    n_failed = 0
+
+    for seed in range(seeds):
+        rules = random_grammar(random.Random(seed))
+        grammar = CompiledGrammar(rules)
+        parsers = [EarleyParser(grammar), EarleyParser(grammar, lookahead=False)]
+
+        for tokens in all_inputs(TERMINALS + [UNKNOWN], 1, max_length):
+            mismatches = check_input(parsers, tokens, max_tree_length)
+            n_inputs += 1
+
+            if mismatches:
+                n_failed += 1
+                print("seed {} {} {}: {}".format(seed, rules, tokens, mismatches), file=out)
+
+    print("{} of {} inputs failed".format(n_failed, n_inputs), file=out)
+
+    return n_failed
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="pyearley span query check")
+    arg_parser.add_argument("--seeds", type=int, default=300, help="number of random grammars")
+    arg_parser.add_argument("--max-length", type=int, default=5, help="longest input")
+    arg_parser.add_argument("--max-tree-length", type=int, default=3, help="longest input whose trees are checked")
+    args = arg_parser.parse_args(argv)
+
+    return 1 if run_check(args.seeds, args.max_length, args.max_tree_length) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+#encoding: UTF-8
+
+import argparse, gc, json, os, platform, random, subprocess, sys, time, tracemalloc
+from pyearley_test import ruleset1, ruleset2, ruleset3, ruleset4
+from pyearley_test.benchmark import sentence
+from pyearley.rule import Literal, Forward, one_of, optional, star, plus
+from pyearley.earley import EarleyParser as PureEarleyParser
+from pyearley.grammar import compile_grammar
+from pyearley.stats import ParseStats, timer
+
+# Benchmark suite
+# Every case parses inputs of growing size with a grammar of pyearley_test or a synthetic stress grammar,
+# and reports throughput, latency percentiles, chart size and peak memory.
+# Results are saved as JSON so that runs on different commits can be compared:
+#
+#   python -m pyearley_test.suite -o base.json
+#   python -m pyearley_test.suite -o new.json --compare base.json
+
+FORMAT_NAME = "pyearley-benchmark"
+FORMAT_VERSION = 1
+
+def left_recursion():
+    """
+    L -> L a | a
+    """
+    L = Forward("L")
+    L << ((L + Literal("a")) | Literal("a"))
+
+    return L, lambda n, rnd: ["a"] * n
+
+def right_recursion():
+    """
+    R -> a R | a
+    """
+    R = Forward("R")
+    R << ((Literal("a") + R) | Literal("a"))
+
+    return R, lambda n, rnd: ["a"] * n
+
+def ambiguous_star():
+    """
+    S -> (a | a a)*, whose number of parses grows as the Fibonacci numbers
+    """
+    S = star(Literal("a") | (Literal("a") + Literal("a")))
+    S.set_name("S")
+
+    return S, lambda n, rnd: ["a"] * n
+
+def catalan():
+    """
+    S -> S S | a, whose number of parses grows as the Catalan numbers
+    """
+    S = Forward("S")
+    S << ((S + S) | Literal("a"))
+
+    return S, lambda n, rnd: ["a"] * n
+
+def optional_epsilons():
+    """
+    S -> (a? b? c? d? e? f)+
+    """
+    letters = ["a", "b", "c", "d", "e"]
+    group = optional(Literal(letters[0]))
+
+    for letter in letters[1:]:
+        group = group + optional(Literal(letter))
+
+    S = plus(group + Literal("f"))
+    S.set_name("S")
+
+    def _tokens(n, rnd):
+        tokens = []
+
+        while len(tokens) < n:
+            tokens.extend(letter for letter in letters if rnd.random() < 0.5)
+            tokens.append("f")
+
+        return tokens
+
+    return S, _tokens
+
+def wide_alternation():
+    """
+    S -> (w000 | w001 | ... | w299)+
+    """
+    words = ["w{:03d}".format(i) for i in range(300)]
+    S = plus(one_of(words))
+    S.set_name("S")
+
+    return S, lambda n, rnd: [rnd.choice(words) for i in range(n)]
+
+def _ruleset1():
+    A, B = ruleset1()
+
+    return A, lambda n, rnd: ["Y"] + ["X", "Z"] * max(0, (n - 2) // 2) + ["X"]
+
+def _ruleset2():
+    return ruleset2(), lambda n, rnd: ["X", "Y", "Y"][:n]
+
+def _ruleset3():
+    return ruleset3(), lambda n, rnd: ["X"] + ["Y", "X"] * max(0, (n - 1) // 2)
+
+def _ruleset4():
+    return ruleset4(), lambda n, rnd: sentence(max(1, (n - 6) // 4 + 1))
+
+#(name, grammar, mode, sizes); "trees" parses into trees, "count" only counts the parses of highly ambiguous grammars
+CASES = [("ruleset1", _ruleset1, "trees", [8, 32, 128]),
+         ("ruleset2", _ruleset2, "trees", [1, 2, 3]),
+         ("ruleset3", _ruleset3, "trees", [9, 33, 129]),
+         ("ruleset4", _ruleset4, "trees", [10, 34, 130]),
+         ("left_recursion", left_recursion, "trees", [64, 256, 1024]),
+         ("right_recursion", right_recursion, "trees", [64, 256, 1024]),
+         ("ambiguous_star", ambiguous_star, "count", [16, 64, 256]),
+         ("catalan", catalan, "count", [8, 16, 32]),
+         ("optional_epsilons", optional_epsilons, "trees", [16, 64, 256]),
+         ("wide_alternation", wide_alternation, "trees", [16, 64, 256])]
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of the values
+    """
+    values = sorted(values)
+    rank = max(1, int(-(-p * len(values) // 100)))
+
+    return values[rank - 1]
+
+def run_case(parser, symbol, tokens, mode, repeat):
+    def _parse(stats=None):
+        if mode == "count":
+            return parser.count_parses(tokens, symbol, stats=stats)
+
+        return len(parser.parse(tokens, symbol, prune_temp=True, stats=stats))
+
+    #warm up, and collect the counters
+    stats = ParseStats()
+    result = _parse(stats)
+
+    latencies = []
+
+    for i in range(repeat):
+        gc.collect()
+        start = timer()
+        _parse()
+        latencies.append(timer() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    _parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"tokens": len(tokens),
+            "result": result,
+            "repeat": repeat,
+            "parses_per_sec": repeat / sum(latencies),
+            "mean_ms": 1000.0 * sum(latencies) / repeat,
+            "p50_ms": 1000.0 * percentile(latencies, 50),
+            "p99_ms": 1000.0 * percentile(latencies, 99),
+            "chart_items": stats.items,
+            "back_pointers": stats.back_pointers,
+            "forest_nodes": stats.forest_nodes,
+            "peak_kib": peak // 1024}
+
+def _commit():
+    #None outside of a git checkout
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(case_names=None, repeat=20, quick=False, lookahead=True, optimize=False, out=sys.stdout):
+    results = []
+
+    print("{:>18} {:>8} {:>12} {:>10} {:>10} {:>10} {:>12} {:>10} {:>12}".format(
+        "case", "tokens", "parses/sec", "p50 ms", "p99 ms", "items", "back-ptrs", "peak KiB", "parses"), file=out)
+
+    for name, make_grammar, mode, sizes in CASES:
+        if case_names and name not in case_names:
+            continue
+
+        symbol, make_tokens = make_grammar()
+        parser = PureEarleyParser(compile_grammar(symbol, optimize), lookahead)
+
+        for size in (sizes[:2] if quick else sizes):
+            tokens = make_tokens(size, random.Random("{}:{}".format(name, size)))
+
+            result = run_case(parser, symbol, tokens, mode, repeat)
+            result.update({"case": name, "size": size, "mode": mode})
+            results.append(result)
+
+            print("{:>18} {:>8} {:>12.1f} {:>10.3f} {:>10.3f} {:>10} {:>12} {:>10} {:>12}".format(
+                name, result["tokens"], result["parses_per_sec"], result["p50_ms"], result["p99_ms"],
+                result["chart_items"], result["back_pointers"], result["peak_kib"], result["result"]), file=out)
+
+    return {"format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "commit": _commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": {"repeat": repeat, "quick": quick, "lookahead": lookahead, "optimize": optimize},
+            "results": results}
+
+def compare(baseline, current, threshold=0.1, out=sys.stdout):
+    """
+    Prints the current results against the baseline ones, case by case.
+    Returns the (case, tokens) pairs whose median latency grew by more than `threshold`, or whose chart grew.
+    """
+    base = dict(((r["case"], r["tokens"]), r) for r in baseline["results"])
+    regressions = []
+
+    print("", file=out)
+    print("{:>18} {:>8} {:>12} {:>12} {:>8} {:>10} {:>10}".format("case", "tokens", "base p50 ms", "p50 ms", "ratio", "base items", "items"), file=out)
+
+    for r in current["results"]:
+        key = (r["case"], r["tokens"])
+
+        if key not in base:
+            continue
+
+        b = base[key]
+        ratio = r["p50_ms"] / b["p50_ms"] if b["p50_ms"] else float("inf")
+        regressed = ratio > 1.0 + threshold or r["chart_items"] > b["chart_items"]
+
+        if regressed:
+            regressions.append(key)
+
+        print("{:>18} {:>8} {:>12.3f} {:>12.3f} {:>8.2f} {:>10} {:>10}{}".format(
+            r["case"], r["tokens"], b["p50_ms"], r["p50_ms"], ratio, b["chart_items"], r["chart_items"], "  REGRESSION" if regressed else ""), file=out)
+
+    return regressions
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="pyearley benchmark suite")
+    arg_parser.add_argument("-o", "--output", help="file to save the results to, as JSON")
+    arg_parser.add_argument("--compare", help="results of an earlier run to compare against")
+    arg_parser.add_argument("--threshold", type=float, default=0.1, help="median latency increase reported as a regression")
+    arg_parser.add_argument("--repeat", type=int, default=20, help="timed parses per input")
+    arg_parser.add_argument("--quick", action="store_true", help="only run the smaller inputs")
+    arg_parser.add_argument("--cases", help="comma separated names of the cases to run")
+    arg_parser.add_argument("--no-lookahead", action="store_true", help="predict without FIRST set lookahead")
+    arg_parser.add_argument("--optimize", action="store_true", help="optimize the compiled grammars")
+    args = arg_parser.parse_args(argv)
+
+    results = run_suite(args.cases.split(",") if args.cases else None, args.repeat, args.quick, not args.no_lookahead, args.optimize)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        if baseline.get("format") != FORMAT_NAME:
+            raise ValueError("not benchmark results: {}".format(args.compare))
+
+        if compare(baseline, results, args.threshold):
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())